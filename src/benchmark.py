@@ -0,0 +1,415 @@
+import argparse
+import html
+import importlib.util
+import json
+import logging
+import os
+import random
+import socketserver
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import jwt
+
+from geo import haversine_km
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+LOCATIONS = ["Olofshöjd", "Rotpartner", "Ekebäck", "Medicinareberget", "Gibraltar"]
+SIZES = ["1 rok", "2 rok", "3 rok", "Korridorrum"]
+PLACES = [
+    "Chalmers",
+    "Centralstationen",
+    "Lindholmen",
+    "Sahlgrenska",
+    "Haga",
+    "Järntorget",
+    "Korsvägen",
+    "Linné",
+    "Majorna",
+    "Frölunda",
+    "Angered",
+    "Backaplan",
+]
+
+# the card DOM the market page renders, as read by sgs.parse_cards
+MARKET_PAGE = """<html>
+<head><title>Mina Sidor</title></head>
+<body><taiga-market-objects-list>{cards}</taiga-market-objects-list></body>
+</html>"""
+MARKET_CARD = """<div><mat-card id="{id}">
+<div class="address">{address}</div>
+<div class="location">{location}</div>
+<div class="size"><p>{size}</p><p>Storlek</p></div>
+<div class="area"><p>{area}</p><p>m²</p></div>
+<div class="rent"><p>{rent}</p><p>kr/mån</p></div>
+<div class="free-from"><p>{free-from}</p><p>Tillträde</p></div>
+</mat-card></div>"""
+
+# the bot is a script with a dash in its name, so it cannot be imported directly
+_spec = importlib.util.spec_from_file_location(
+    "sgs_bot", os.path.join(os.path.dirname(os.path.abspath(__file__)), "sgs-bot.py")
+)
+bot = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(bot)
+
+
+class FakeSGS:
+    def __init__(self, apartments: int, seed=0) -> None:
+        self.random = random.Random(seed)
+        self.next_id = 0
+        self.cards = [self._card() for _ in range(apartments)]
+        self._lock = threading.Lock()
+
+    def replace(self, share):
+        # relists a share of the apartments, so that following runs find new ones
+        with self._lock:
+            for _ in range(int(len(self.cards) * share)):
+                position = self.random.randrange(len(self.cards))
+                self.cards[position] = self._card()
+
+    def page(self, page, page_size) -> str:
+        with self._lock:
+            cards = self.cards[(page - 1) * page_size : page * page_size]
+        return MARKET_PAGE.format(
+            cards="".join(
+                MARKET_CARD.format_map(
+                    {key: html.escape(value) for key, value in card.items()}
+                )
+                for card in cards
+            )
+        )
+
+    def _card(self) -> dict:
+        # the fields as the script reads them, without the labels the page adds
+        self.next_id += 1
+        free_from = datetime.now() + timedelta(days=self.random.randint(7, 120))
+        return {
+            "id": f"{self.next_id:04d}-0000",
+            "address": f"Benchmarkgatan {self.next_id}",
+            "location": self.random.choice(LOCATIONS),
+            "size": self.random.choice(SIZES),
+            "area": str(round(self.random.uniform(15, 90), 1)),
+            "rent": str(self.random.randrange(3000, 12000, 50)),
+            "free-from": free_from.strftime("%Y-%m-%d"),
+        }
+
+
+class FakeVasttrafik:
+    def __init__(self, latency=0.0) -> None:
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def handle(self, path, query) -> dict | None:
+        with self._lock:
+            self.requests += 1
+        time.sleep(self.latency)
+
+        if path.endswith("/token"):
+            return {
+                "access_token": jwt.encode(
+                    {"exp": int(time.time()) + 3600},
+                    "benchmark-signing-key-of-sufficient-length",
+                ),
+                "expires_in": 3600,
+            }
+        if path.endswith("/locations/by-text"):
+            latitude, longitude = _coordinates(query["q"][0])
+            return {
+                "results": [
+                    {
+                        "name": query["q"][0],
+                        "locationType": "address",
+                        "latitude": latitude,
+                        "longitude": longitude,
+                        "hasLocalService": False,
+                    }
+                ]
+            }
+        if path.endswith("/journeys"):
+            distance = haversine_km(
+                float(query["originLatitude"][0]),
+                float(query["originLongitude"][0]),
+                float(query["destinationLatitude"][0]),
+                float(query["destinationLongitude"][0]),
+            )
+            departure = datetime.fromisoformat(query["datetime"][0])
+            arrival = departure + timedelta(minutes=5 + 3 * distance)
+            return {
+                "results": [
+                    {
+                        "destinationLink": {
+                            "plannedDepartureTime": departure.isoformat(),
+                            "plannedArrivalTime": arrival.isoformat(),
+                        }
+                    }
+                ]
+            }
+        return None
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self) -> None:
+        super().__init__(("127.0.0.1", 0), _SMTPHandler)
+        self.messages: list[tuple[str, list[str], bytes]] = []
+        self.lock = threading.Lock()
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        sender, receivers = None, []
+        self._reply("220 benchmark ESMTP")
+        while line := self.rfile.readline():
+            command, _, argument = line.decode().strip().partition(" ")
+            command = command.upper()
+            if command == "EHLO":
+                self._reply("250-benchmark", "250-AUTH PLAIN", "250 SIZE 10485760")
+            elif command == "HELO":
+                self._reply("250 benchmark")
+            elif command == "AUTH":
+                self._reply("235 authenticated")
+            elif command == "MAIL":
+                sender, receivers = argument[5:].strip("<>"), []
+                self._reply("250 ok")
+            elif command == "RCPT":
+                receivers.append(argument[3:].strip("<>"))
+                self._reply("250 ok")
+            elif command == "DATA":
+                self._reply("354 end with <CRLF>.<CRLF>")
+                data = b"".join(iter(self.rfile.readline, b".\r\n"))
+                with self.server.lock:
+                    self.server.messages.append((sender, receivers, data))
+                self._reply("250 queued")
+            elif command in ("NOOP", "RSET"):
+                self._reply("250 ok")
+            elif command == "QUIT":
+                self._reply("221 bye")
+                break
+            else:
+                self._reply("502 not implemented")
+
+    def _reply(self, *lines):
+        self.wfile.write("".join(f"{line}\r\n" for line in lines).encode())
+
+
+def _coordinates(search) -> tuple[float, float]:
+    # spreads the searches deterministically over the Gothenburg area
+    checksum = zlib.crc32(search.encode())
+    return (
+        57.62 + (checksum % 1000) / 1000 * 0.18,
+        11.85 + (checksum // 1000 % 1000) / 1000 * 0.3,
+    )
+
+
+def _serve_http(fake_sgs: FakeSGS, fake_vasttrafik: FakeVasttrafik):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *_args):
+            pass
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            if url.path == "/market/residential":
+                self._send_page(
+                    fake_sgs.page(int(query["page"][0]), int(query["pageSize"][0]))
+                )
+            else:
+                self._send(fake_vasttrafik.handle(url.path, query))
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self._send(fake_vasttrafik.handle(urlparse(self.path).path, {}))
+
+        def _send_page(self, page):
+            content = page.encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def _send(self, body):
+            if body is None:
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            content = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_subscriptions(config, engine, subscriptions, destinations, seed=0):
+    rng = random.Random(seed)
+    parser = bot.get_argument_parser()
+    for subscription in range(subscriptions):
+        args = parser.parse_args(
+            [
+                "subscription",
+                "add",
+                "--email",
+                f"subscriber{subscription}@example.com",
+                "--max_rent",
+                str(rng.randrange(4000, 12000, 500)),
+                "--min_area",
+                str(rng.randrange(10, 50, 5)),
+                "--destinations",
+                *rng.sample(PLACES, min(destinations, len(PLACES))),
+            ]
+        )
+        args.func(config, engine, args)
+
+
+def stage_summary(report) -> dict:
+    counters = report["counters"]
+    # the items each stage works through, to turn its time into a throughput
+    items = {
+        "scrape": counters.get("apartments_written", 0),
+        "store_apartments": counters.get("apartments_written", 0),
+        "match": counters.get("apartments_written", 0),
+        "geocode": counters.get("matches", 0),
+        "plan_journeys": counters.get("distances_written", 0),
+        "store_matches": counters.get("subscribed_apartments_written", 0),
+        "render": counters.get("messages_queued", 0),
+        "deliver": counters.get("mails_sent", 0),
+    }
+    return {
+        stage: {
+            "seconds": seconds,
+            "items": items.get(stage, 0),
+            "items_per_second": items.get(stage, 0) / seconds if seconds else None,
+        }
+        for stage, seconds in report["stages"].items()
+    }
+
+
+def run_benchmark(args) -> dict:
+    fake_sgs = FakeSGS(args.apartments, args.seed)
+    fake_vasttrafik = FakeVasttrafik(args.latency)
+    http_server = _serve_http(fake_sgs, fake_vasttrafik)
+    smtp_sink = SMTPSink()
+    threading.Thread(target=smtp_sink.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{http_server.server_port}"
+
+    data_root = tempfile.mkdtemp(prefix="sgs-benchmark-")
+    config = bot.Config(
+        data_root=data_root,
+        vasttrafik_api_key="benchmark",
+        smpt_server="127.0.0.1",
+        smtp_port=smtp_sink.server_address[1],
+        smtp_user="bot@example.com",
+        smtp_password="benchmark",
+        vasttrafik_rate=args.rate,
+        vasttrafik_burst=max(int(args.rate), 1),
+        vasttrafik_url=f"{base_url}/pr/v4",
+        vasttrafik_token_url=f"{base_url}/token",
+        sgs_url=f"{base_url}/market/residential?pageSize={{page_size}}&page={{page}}",
+        smtp_ssl=False,
+    )
+    engine = bot.get_db_engine(config)
+    add_subscriptions(config, engine, args.subscriptions, args.destinations, args.seed)
+
+    crawl_args = bot.get_argument_parser().parse_args(
+        [
+            "crawl",
+            "--workers",
+            str(args.workers),
+            "--matcher",
+            args.matcher,
+            "--smtp_connections",
+            str(args.smtp_connections),
+        ]
+    )
+
+    runs = []
+    for run in range(args.runs):
+        if run > 0:
+            fake_sgs.replace(args.churn)
+        vasttrafik_requests = fake_vasttrafik.requests
+        mails = len(smtp_sink.messages)
+
+        bot.crawl(config, engine, crawl_args)
+
+        with open(os.path.join(data_root, bot.RUN_REPORT_FILE), encoding="utf-8") as f:
+            report = json.load(f)
+        runs.append(
+            {
+                "run": run,
+                "duration_seconds": report["duration_seconds"],
+                "apartments_per_second": args.apartments / report["duration_seconds"],
+                "stages": stage_summary(report),
+                "counters": report["counters"],
+                "histograms": report["histograms"],
+                "mock_vasttrafik_requests": fake_vasttrafik.requests
+                - vasttrafik_requests,
+                "mails_received": len(smtp_sink.messages) - mails,
+            }
+        )
+
+    engine.dispose()
+    http_server.shutdown()
+    smtp_sink.shutdown()
+
+    return {
+        "parameters": {
+            "apartments": args.apartments,
+            "subscriptions": args.subscriptions,
+            "destinations": args.destinations,
+            "latency": args.latency,
+            "rate": args.rate,
+            "workers": args.workers,
+            "matcher": args.matcher,
+            "churn": args.churn,
+            "seed": args.seed,
+        },
+        "data_root": data_root,
+        "runs": runs,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Runs crawl end-to-end against local stand-ins of SGS, "
+        "Västtrafik and an SMTP server. The market page is loaded through the "
+        "browser like in production, so Firefox and geckodriver need to be "
+        "installed."
+    )
+    parser.add_argument("--apartments", type=int, default=500)
+    parser.add_argument("--subscriptions", type=int, default=50)
+    parser.add_argument("--destinations", type=int, default=2)
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--rate", type=float, default=1000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--matcher", choices=["memory", "sql"], default="memory")
+    parser.add_argument("--smtp_connections", type=int, default=3)
+    parser.add_argument("--runs", type=int, default=2)
+    parser.add_argument("--churn", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str)
+    args = parser.parse_args()
+
+    result = run_benchmark(args)
+    output = json.dumps(result, indent=2)
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
@@ -0,0 +1,132 @@
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from database import CachedDuration, CachedLocation
+from vasttrafik import Location
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+
+class VasttrafikCache:
+    def __init__(self, engine, ttl: timedelta, max_entries: int) -> None:
+        self.engine = engine
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    def get_location(self, search) -> Location | None:
+        with Session(self.engine) as session:
+            cached = session.get(CachedLocation, search)
+
+        if cached is None or self._is_expired(cached.updated):
+            return None
+
+        return Location(
+            name=cached.name,
+            location_type=cached.location_type,
+            latitude=cached.latitude,
+            longitude=cached.longitude,
+            has_local_service=cached.has_local_service,
+        )
+
+    def store_location(self, search, location: Location):
+        values = {
+            "search": search,
+            "name": location.name,
+            "location_type": location.location_type,
+            "latitude": location.latitude,
+            "longitude": location.longitude,
+            "has_local_service": location.has_local_service,
+            "updated": datetime.now(),
+        }
+        statement = (
+            insert(CachedLocation)
+            .values(values)
+            .on_conflict_do_update(index_elements=["search"], set_=values)
+        )
+
+        with Session(self.engine) as session:
+            session.execute(statement)
+            session.commit()
+
+    def get_duration(self, origin: Location, destination: Location) -> timedelta | None:
+        with Session(self.engine) as session:
+            cached = session.get(
+                CachedDuration,
+                (
+                    origin.latitude,
+                    origin.longitude,
+                    destination.latitude,
+                    destination.longitude,
+                ),
+            )
+
+        if cached is None or self._is_expired(cached.updated):
+            return None
+
+        return timedelta(seconds=cached.seconds)
+
+    def store_duration(
+        self, origin: Location, destination: Location, duration: timedelta
+    ):
+        values = {
+            "origin_latitude": origin.latitude,
+            "origin_longitude": origin.longitude,
+            "destination_latitude": destination.latitude,
+            "destination_longitude": destination.longitude,
+            "seconds": duration.total_seconds(),
+            "updated": datetime.now(),
+        }
+        statement = (
+            insert(CachedDuration)
+            .values(values)
+            .on_conflict_do_update(
+                index_elements=[
+                    "origin_latitude",
+                    "origin_longitude",
+                    "destination_latitude",
+                    "destination_longitude",
+                ],
+                set_={"seconds": values["seconds"], "updated": values["updated"]},
+            )
+        )
+
+        with Session(self.engine) as session:
+            session.execute(statement)
+            session.commit()
+
+    def evict(self):
+        with Session(self.engine) as session:
+            for table in (CachedLocation, CachedDuration):
+                expired = session.execute(
+                    delete(table).where(table.updated < datetime.now() - self.ttl)
+                ).rowcount
+
+                count = session.scalar(select(func.count()).select_from(table))
+                overflow = max(count - self.max_entries, 0)
+                if overflow > 0:
+                    oldest = (
+                        select(table.updated)
+                        .order_by(table.updated)
+                        .offset(overflow - 1)
+                        .limit(1)
+                        .scalar_subquery()
+                    )
+                    session.execute(delete(table).where(table.updated <= oldest))
+
+                log.info(
+                    "evicted %(expired)s expired and %(overflow)s overflowing entries from %(table)s",
+                    {
+                        "expired": expired,
+                        "overflow": overflow,
+                        "table": table.__tablename__,
+                    },
+                )
+            session.commit()
+
+    def _is_expired(self, updated: datetime) -> bool:
+        return updated < datetime.now() - self.ttl
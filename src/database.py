@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from sqlalchemy import ForeignKey, func
+from sqlalchemy import JSON, ForeignKey, Index, func, inspect, text
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 
 
@@ -10,6 +10,7 @@ class Base(DeclarativeBase):
 
 class Apartment(Base):
     __tablename__ = "apartments"
+    __table_args__ = (Index("ix_apartments_rent_area", "rent", "area"),)
     id: Mapped[str] = mapped_column(primary_key=True)
     address: Mapped[str]
     location: Mapped[str]
@@ -19,6 +20,11 @@ class Apartment(Base):
     free_from: Mapped[datetime]
     url: Mapped[str]
     updated: Mapped[datetime] = mapped_column(server_default=func.now())
+    content_hash: Mapped[str | None]
+    first_seen: Mapped[datetime | None]
+    last_seen: Mapped[datetime | None]
+    latitude: Mapped[float | None]
+    longitude: Mapped[float | None]
 
 
 class Subscription(Base):
@@ -27,15 +33,31 @@ class Subscription(Base):
     email: Mapped[str]
     max_rent: Mapped[int]
     min_area: Mapped[int]
+    last_matched: Mapped[datetime | None]
+    locations: Mapped[list[str] | None] = mapped_column(JSON(none_as_null=True))
+    sizes: Mapped[list[str] | None] = mapped_column(JSON(none_as_null=True))
+    free_from_after: Mapped[datetime | None]
+    free_from_before: Mapped[datetime | None]
+    max_commute: Mapped[int | None]
+
+
+class Place(Base):
+    __tablename__ = "places"
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    key: Mapped[str] = mapped_column(unique=True)
+    name: Mapped[str]
+    latitude: Mapped[float | None]
+    longitude: Mapped[float | None]
 
 
 class Destination(Base):
     __tablename__ = "destinations"
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     subscription_id: Mapped[int] = mapped_column(
-        ForeignKey("subscriptions.id", ondelete="CASCADE")
+        ForeignKey("subscriptions.id", ondelete="CASCADE"), index=True
     )
     destination: Mapped[str]
+    place_id: Mapped[int | None] = mapped_column(ForeignKey("places.id"), index=True)
 
 
 class Distance(Base):
@@ -43,14 +65,21 @@ class Distance(Base):
     apartment_id: Mapped[int] = mapped_column(
         ForeignKey("apartments.id", ondelete="CASCADE"), primary_key=True
     )
-    destination_id: Mapped[int] = mapped_column(
-        ForeignKey("destinations.id", ondelete="CASCADE"), primary_key=True
+    place_id: Mapped[int] = mapped_column(
+        ForeignKey("places.id", ondelete="CASCADE"), primary_key=True
     )
     time: Mapped[int]
 
 
 class SubscribedApartments(Base):
     __tablename__ = "subscribed_apartments"
+    __table_args__ = (
+        Index(
+            "ix_subscribed_apartments_notified_subscription_id",
+            "notified",
+            "subscription_id",
+        ),
+    )
     apartment_id: Mapped[int] = mapped_column(
         ForeignKey("apartments.id", ondelete="CASCADE"), primary_key=True
     )
@@ -58,3 +87,105 @@ class SubscribedApartments(Base):
         ForeignKey("subscriptions.id", ondelete="CASCADE"), primary_key=True
     )
     notified: Mapped[bool] = mapped_column(default=False)
+
+
+class OutboxMessage(Base):
+    __tablename__ = "outbox"
+    __table_args__ = (Index("ix_outbox_sent_attempts", "sent", "attempts"),)
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    receiver: Mapped[str]
+    subject: Mapped[str]
+    content: Mapped[str]
+    html: Mapped[str | None]
+    created: Mapped[datetime] = mapped_column(server_default=func.now())
+    sent: Mapped[datetime | None]
+    attempts: Mapped[int] = mapped_column(default=0)
+    next_attempt: Mapped[datetime | None]
+    last_error: Mapped[str | None]
+
+
+class CachedLocation(Base):
+    __tablename__ = "location_cache"
+    search: Mapped[str] = mapped_column(primary_key=True)
+    name: Mapped[str]
+    location_type: Mapped[str]
+    latitude: Mapped[float]
+    longitude: Mapped[float]
+    has_local_service: Mapped[bool]
+    updated: Mapped[datetime]
+
+
+class CachedDuration(Base):
+    __tablename__ = "duration_cache"
+    origin_latitude: Mapped[float] = mapped_column(primary_key=True)
+    origin_longitude: Mapped[float] = mapped_column(primary_key=True)
+    destination_latitude: Mapped[float] = mapped_column(primary_key=True)
+    destination_longitude: Mapped[float] = mapped_column(primary_key=True)
+    seconds: Mapped[float]
+    updated: Mapped[datetime]
+
+
+def migrate(engine):
+    inspector = inspect(engine)
+    existing_tables = inspector.get_table_names()
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+
+            existing_columns = {
+                column["name"] for column in inspector.get_columns(table.name)
+            }
+            for column in table.columns:
+                if column.name not in existing_columns:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    connection.execute(
+                        text(
+                            f"ALTER TABLE {table.name} "
+                            f"ADD COLUMN {column.name} {column_type}"
+                        )
+                    )
+
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+
+        _migrate_distances_to_places(connection)
+
+
+def get_place_key(name: str) -> str:
+    return " ".join(name.split()).casefold()
+
+
+def _migrate_distances_to_places(connection):
+    inspector = inspect(connection)
+    if "destination_id" not in {
+        column["name"] for column in inspector.get_columns("distances")
+    }:
+        return
+
+    places = {}
+    for destination_id, destination in connection.execute(
+        text("SELECT id, destination FROM destinations")
+    ):
+        key = get_place_key(destination)
+        if key not in places:
+            places[key] = connection.execute(
+                text("INSERT INTO places (key, name) VALUES (:key, :name)"),
+                {"key": key, "name": destination},
+            ).lastrowid
+        connection.execute(
+            text("UPDATE destinations SET place_id = :place_id WHERE id = :id"),
+            {"place_id": places[key], "id": destination_id},
+        )
+
+    connection.execute(text("ALTER TABLE distances RENAME TO destination_distances"))
+    Distance.__table__.create(connection)
+    connection.execute(
+        text(
+            "INSERT OR IGNORE INTO distances (apartment_id, place_id, time) "
+            "SELECT destination_distances.apartment_id, destinations.place_id, "
+            "destination_distances.time FROM destination_distances "
+            "JOIN destinations ON destinations.id = destination_distances.destination_id"
+        )
+    )
+    connection.execute(text("DROP TABLE destination_distances"))
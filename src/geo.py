@@ -0,0 +1,65 @@
+import math
+from collections import defaultdict
+from collections.abc import Hashable
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.32
+
+# faster than any public transport connection in the region, so that the
+# straight-line travel time never exceeds the planned one
+MAX_TRAVEL_SPEED_KMH = 150.0
+
+
+def haversine_km(latitude_a, longitude_a, latitude_b, longitude_b) -> float:
+    latitude_a, longitude_a, latitude_b, longitude_b = map(
+        math.radians, (latitude_a, longitude_a, latitude_b, longitude_b)
+    )
+    a = (
+        math.sin((latitude_b - latitude_a) / 2) ** 2
+        + math.cos(latitude_a)
+        * math.cos(latitude_b)
+        * math.sin((longitude_b - longitude_a) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def reachable_distance_km(minutes) -> float:
+    return MAX_TRAVEL_SPEED_KMH * minutes / 60
+
+
+class GeoGrid:
+    def __init__(self, cell_degrees=0.05) -> None:
+        self.cell_degrees = cell_degrees
+        self.cells: dict[tuple[int, int], list] = defaultdict(list)
+
+    def add(self, key: Hashable, latitude, longitude):
+        self.cells[self._cell(latitude, longitude)].append((key, latitude, longitude))
+
+    def within(self, latitude, longitude, radius_km) -> set:
+        latitude_span = radius_km / KM_PER_DEGREE
+        longitude_span = radius_km / (
+            KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01)
+        )
+        min_row, min_column = self._cell(
+            latitude - latitude_span, longitude - longitude_span
+        )
+        max_row, max_column = self._cell(
+            latitude + latitude_span, longitude + longitude_span
+        )
+
+        return {
+            key
+            for row in range(min_row, max_row + 1)
+            for column in range(min_column, max_column + 1)
+            for key, point_latitude, point_longitude in self.cells.get(
+                (row, column), ()
+            )
+            if haversine_km(latitude, longitude, point_latitude, point_longitude)
+            <= radius_km
+        }
+
+    def _cell(self, latitude, longitude) -> tuple[int, int]:
+        return (
+            math.floor(latitude / self.cell_degrees),
+            math.floor(longitude / self.cell_degrees),
+        )
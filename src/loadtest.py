@@ -0,0 +1,238 @@
+import argparse
+import json
+import logging
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+
+from benchmark import PLACES, FakeSGS, bot
+from database import (
+    Apartment,
+    Destination,
+    Distance,
+    Place,
+    Subscription,
+    get_place_key,
+)
+from render import MailRenderer
+from sgs import SGSApartment
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+
+def fill_database(engine, apartments, subscriptions, destinations, seen, seed=0):
+    rng = random.Random(seed)
+    place_names = PLACES + [
+        f"Plats {place}" for place in range(max(destinations - len(PLACES), 0))
+    ]
+
+    with Session(engine) as session:
+        bot.store_appartments(
+            session,
+            [SGSApartment.from_card(card) for card in FakeSGS(apartments, seed).cards],
+            seen,
+            chunk_size=500,
+        )
+        apartment_ids = session.execute(select(Apartment.id)).scalars().all()
+
+        session.execute(
+            insert(Place),
+            [
+                {"id": place_id, "key": get_place_key(name), "name": name}
+                for place_id, name in enumerate(place_names, start=1)
+            ],
+        )
+        session.execute(
+            insert(Subscription),
+            [
+                {
+                    "id": subscription_id,
+                    "email": f"subscriber{subscription_id}@example.com",
+                    # narrow enough that about a tenth of the apartments match
+                    "max_rent": rng.randrange(3500, 6000, 250),
+                    "min_area": rng.randrange(20, 70, 5),
+                }
+                for subscription_id in range(1, subscriptions + 1)
+            ],
+        )
+        session.execute(
+            insert(Destination),
+            [
+                {
+                    "subscription_id": subscription_id,
+                    "destination": place_names[place_id - 1],
+                    "place_id": place_id,
+                }
+                for subscription_id in range(1, subscriptions + 1)
+                for place_id in rng.sample(
+                    range(1, len(place_names) + 1), min(destinations, len(place_names))
+                )
+            ],
+        )
+        session.execute(
+            insert(Distance),
+            [
+                {
+                    "apartment_id": apartment_id,
+                    "place_id": place_id,
+                    "time": rng.randint(5, 90),
+                }
+                for apartment_id in apartment_ids
+                for place_id in range(1, len(place_names) + 1)
+            ],
+        )
+        session.commit()
+
+
+def render_digests(notifications):
+    renderer = MailRenderer()
+    return [
+        renderer.render_digest(apartment_dict)
+        for apartment_dict in notifications.values()
+    ]
+
+
+def profile_phase(engine, function, prepare=None) -> tuple[object, dict]:
+    # the phase runs twice in fresh sessions, as tracing the allocations slows
+    # it down too much to time it in the same pass
+    with Session(engine) as session:
+        argument = prepare(session) if prepare is not None else session
+        start = time.perf_counter()
+        result = function(argument)
+        seconds = time.perf_counter() - start
+
+    with Session(engine) as session:
+        argument = prepare(session) if prepare is not None else session
+        tracemalloc.start()
+        try:
+            function(argument)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    return result, {"seconds": seconds, "peak_memory_bytes": peak}
+
+
+def run_step(apartments, subscriptions, destinations, args) -> dict:
+    data_root = tempfile.mkdtemp(prefix="sgs-loadtest-")
+    config = bot.Config(
+        data_root=data_root,
+        vasttrafik_api_key="",
+        smpt_server="",
+        smtp_port="",
+        smtp_user="",
+        smtp_password="",
+    )
+    engine = bot.get_db_engine(config)
+    seen = datetime.now()
+
+    try:
+        start = time.perf_counter()
+        fill_database(engine, apartments, subscriptions, destinations, seen, args.seed)
+        log.info(
+            "filled %(apartments)s apartments and %(subscriptions)s subscriptions "
+            "in %(seconds).1fs",
+            {
+                "apartments": apartments,
+                "subscriptions": subscriptions,
+                "seconds": time.perf_counter() - start,
+            },
+        )
+
+        phases = {}
+        matches, phases["match_memory"] = profile_phase(
+            engine, lambda session: bot.get_matches(session, seen, "memory")
+        )
+
+        # the query matcher hydrates every matching row, so it is skipped once
+        # the step would take minutes
+        parity = None
+        if apartments * subscriptions <= args.max_sql_pairs:
+            sql_matches, phases["get_filtered_apartments"] = profile_phase(
+                engine, lambda session: bot.get_matches(session, seen, "sql")
+            )
+            parity = set(sql_matches) == set(matches)
+
+        with Session(engine) as session:
+            bot.store_subscribed_apartments(session, matches, chunk_size=500)
+            session.commit()
+
+        rows, phases["get_new_apartments"] = profile_phase(
+            engine, bot.get_new_apartments
+        )
+        notifications, phases["get_notification"] = profile_phase(
+            engine, bot.get_notification, prepare=bot.get_new_apartments
+        )
+        _, phases["render"] = profile_phase(
+            engine,
+            render_digests,
+            prepare=lambda session: bot.get_notification(
+                bot.get_new_apartments(session)
+            ),
+        )
+    finally:
+        engine.dispose()
+        shutil.rmtree(data_root)
+
+    return {
+        "apartments": apartments,
+        "subscriptions": subscriptions,
+        "destinations": destinations,
+        "matches": len(matches),
+        "new_apartment_rows": len(rows),
+        "notifications": len(notifications),
+        "matcher_parity": parity,
+        "phases": phases,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Profiles matching and notification building on growing "
+        "synthetic databases."
+    )
+    parser.add_argument(
+        "--apartments", type=int, nargs="+", default=[1000, 2500, 5000, 10000]
+    )
+    parser.add_argument(
+        "--subscriptions", type=int, nargs="+", default=[100, 250, 500, 1000]
+    )
+    parser.add_argument("--destinations", type=int, default=2)
+    parser.add_argument("--max_sql_pairs", type=int, default=1000000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str)
+    parser.add_argument("--history", type=str)
+    args = parser.parse_args()
+    if len(args.apartments) != len(args.subscriptions):
+        parser.error("--apartments and --subscriptions need the same number of sizes")
+
+    started = datetime.now()
+    steps = []
+    for apartments, subscriptions in zip(args.apartments, args.subscriptions):
+        steps.append(run_step(apartments, subscriptions, args.destinations, args))
+        log.info("step finished: %s", steps[-1]["phases"])
+
+    result = {
+        "started": started.isoformat(),
+        "destinations": args.destinations,
+        "seed": args.seed,
+        "steps": steps,
+    }
+    output = json.dumps(result, indent=2)
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    # one line per run, so that the scaling curve can be followed over time
+    if args.history is not None:
+        with open(args.history, "a", encoding="utf-8") as f:
+            f.write(json.dumps(result) + "\n")
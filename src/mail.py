@@ -1,6 +1,10 @@
 import logging
+import queue
 import smtplib
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from dataclasses import dataclass
 from email.message import EmailMessage
 from email.utils import formatdate
@@ -9,57 +13,185 @@ logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
 
-class MailSendException(Exception):
-    pass
-
-
 @dataclass
 class SMTPServerConfig:
     server: str
     port: int
     user: str
     password: str
+    ssl: bool = True
+
+
+@dataclass
+class DeliveryResult:
+    message: EmailMessage
+    sent: bool
+    attempts: int
+    error: str | None = None
+
+
+class SMTPConnectionPool:
+    def __init__(self, smtp_server_config: SMTPServerConfig, size=3) -> None:
+        self.smtp_server_config = smtp_server_config
+
+        self._idle: queue.LifoQueue[smtplib.SMTP] = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._login_lock = threading.Lock()
+        self._login_error: smtplib.SMTPAuthenticationError | None = None
+
+    @contextmanager
+    def connection(self):
+        with self._slots:
+            smtp = self._acquire()
+            try:
+                yield smtp
+            except Exception:
+                # the session state is unknown, so the connection is not reused
+                _quit(smtp)
+                raise
+            self._idle.put(smtp)
+
+    def close(self):
+        while True:
+            try:
+                _quit(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+    def _acquire(self) -> smtplib.SMTP:
+        try:
+            smtp = self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+        if _is_healthy(smtp):
+            return smtp
+
+        log.warning("SMTP session was dropped, reconnecting...")
+        _quit(smtp)
+        return self._connect()
+
+    def _connect(self) -> smtplib.SMTP:
+        # logins are serialized, so that rejected credentials are only tried once
+        # and every later message fails without contacting the server
+        with self._login_lock:
+            if self._login_error is not None:
+                raise self._login_error
+
+            log.info("contacting SMTP server...")
+            smtp_class = (
+                smtplib.SMTP_SSL if self.smtp_server_config.ssl else smtplib.SMTP
+            )
+            smtp = smtp_class(
+                self.smtp_server_config.server, self.smtp_server_config.port, timeout=30
+            )
+            try:
+                smtp.login(
+                    self.smtp_server_config.user, self.smtp_server_config.password
+                )
+            except smtplib.SMTPAuthenticationError as error:
+                self._login_error = error
+                _quit(smtp)
+                raise
+            except smtplib.SMTPException:
+                _quit(smtp)
+                raise
+            log.info("Logged into SMTP server.")
+            return smtp
 
 
 class MailServer:
-    def __init__(self, smtp_server_config: SMTPServerConfig) -> None:
+    def __init__(self, smtp_server_config: SMTPServerConfig, connections=3) -> None:
         self.smtp_server_config = smtp_server_config
+        self.connections = connections
         self.registered_messages: list[EmailMessage] = []
 
-    def register_message(self, subject: str, receiver: str, content: str):
+    def register_message(
+        self, subject: str, receiver: str, content: str, html: str | None = None
+    ):
         message = EmailMessage()
         message["Subject"] = subject
         message["From"] = self.smtp_server_config.user
         message["To"] = receiver
         message["Date"] = formatdate(localtime=True)
         message.set_content(content)
+        if html is not None:
+            message.add_alternative(html, subtype="html")
 
         self.registered_messages.append(message)
+        return message
 
-    def send_all(self, attempts=1):
-        while attempts > 0:
-            try:
-                log.info("contacting SMTP server...")
+    def send_all(self, attempts=1, backoff=1.0) -> list[DeliveryResult]:
+        if len(self.registered_messages) == 0:
+            return []
 
-                with smtplib.SMTP_SSL(
-                    self.smtp_server_config.server, self.smtp_server_config.port
-                ) as smtp:
-                    smtp.login(
-                        self.smtp_server_config.user, self.smtp_server_config.password
+        log.info("sending %s messages...", len(self.registered_messages))
+        pool = SMTPConnectionPool(self.smtp_server_config, self.connections)
+        try:
+            with ThreadPoolExecutor(max_workers=self.connections) as executor:
+                results = list(
+                    executor.map(
+                        lambda message: _deliver(pool, message, attempts, backoff),
+                        self.registered_messages,
                     )
-                    log.info("Logged into SMTP server.")
-                    log.info("sending %s messages...", len(self.registered_messages))
-                    for message in self.registered_messages:
-                        smtp.send_message(message)
-                    log.info("Messages sent.")
-                    break
-            except smtplib.SMTPAuthenticationError:
-                log.error(
-                    "Failed to connect to server. Remaining attempts: %s", attempts - 1
                 )
-                attempts -= 1
-                time.sleep(1)
+        finally:
+            pool.close()
+
+        failed = [result for result in results if not result.sent]
+        log.info(
+            "%(sent)s messages sent, %(failed)s failed.",
+            {"sent": len(results) - len(failed), "failed": len(failed)},
+        )
+        for result in failed:
+            log.error(
+                "Failed to send message to %(receiver)s: %(error)s",
+                {"receiver": result.message["To"], "error": result.error},
+            )
+
+        return results
+
+
+def _deliver(pool: SMTPConnectionPool, message: EmailMessage, attempts, backoff):
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            with pool.connection() as smtp:
+                smtp.send_message(message)
+            return DeliveryResult(message, sent=True, attempts=attempt)
+        except (smtplib.SMTPException, OSError) as error:
+            if _is_permanent(error) or attempt >= attempts:
+                return DeliveryResult(
+                    message, sent=False, attempts=attempt, error=repr(error)
+                )
+
+            log.warning(
+                "Failed to send message to %(receiver)s, retrying: %(error)r",
+                {"receiver": message["To"], "error": error},
+            )
+            time.sleep(backoff * 2 ** (attempt - 1))
+
+
+def _is_permanent(error: Exception) -> bool:
+    # a refused address, rejected credentials or a 5xx reply fail the same way
+    # on every attempt
+    if isinstance(
+        error, (smtplib.SMTPRecipientsRefused, smtplib.SMTPAuthenticationError)
+    ):
+        return True
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+
+def _is_healthy(smtp: smtplib.SMTP) -> bool:
+    try:
+        return smtp.noop()[0] == 250
+    except (smtplib.SMTPException, OSError):
+        return False
+
 
-        if attempts == 0:
-            log.error("Failed to connect to the SMTP server.")
-            raise MailSendException("Failed to connect to the SMTP server.")
+def _quit(smtp: smtplib.SMTP):
+    try:
+        smtp.quit()
+    except (smtplib.SMTPException, OSError):
+        smtp.close()
@@ -0,0 +1,89 @@
+from array import array
+from bisect import bisect_right
+from collections.abc import Iterable
+from dataclasses import dataclass
+from datetime import datetime
+
+
+class SubscriptionMatcher:
+    def __init__(self, subscriptions: Iterable[tuple[int, float, int]]) -> None:
+        subscriptions = sorted(subscriptions, key=lambda subscription: subscription[1])
+
+        self.ids = array("q", (subscription[0] for subscription in subscriptions))
+        self.min_areas = array("d", (subscription[1] for subscription in subscriptions))
+        self.max_rents = array("q", (subscription[2] for subscription in subscriptions))
+
+    def match(
+        self, apartments: Iterable[tuple[str, float, int]]
+    ) -> list[tuple[str, int]]:
+        matches = []
+
+        # sweep the apartments by ascending area, so that the subscriptions whose
+        # min_area is below the current area only ever grow. They are kept sorted
+        # by max_rent, which turns the rent filter into a single bisection.
+        active_rents = array("q")
+        active_ids = array("q")
+        next_subscription = 0
+        for apartment_id, area, rent in sorted(
+            apartments, key=lambda apartment: apartment[1]
+        ):
+            while (
+                next_subscription < len(self.ids)
+                and self.min_areas[next_subscription] < area
+            ):
+                max_rent = self.max_rents[next_subscription]
+                position = bisect_right(active_rents, max_rent)
+                active_rents.insert(position, max_rent)
+                active_ids.insert(position, self.ids[next_subscription])
+                next_subscription += 1
+
+            first_match = bisect_right(active_rents, rent)
+            matches.extend(
+                (apartment_id, subscription_id)
+                for subscription_id in active_ids[first_match:]
+            )
+
+        return matches
+
+
+@dataclass
+class SubscriptionCriteria:
+    locations: frozenset[str] | None
+    sizes: frozenset[str] | None
+    free_from_after: datetime | None
+    free_from_before: datetime | None
+
+    @classmethod
+    def from_subscription(cls, subscription) -> "SubscriptionCriteria":
+        return cls(
+            locations=_normalized(subscription.locations),
+            sizes=_normalized(subscription.sizes),
+            free_from_after=subscription.free_from_after,
+            free_from_before=subscription.free_from_before,
+        )
+
+    def accepts(self, apartment) -> bool:
+        if self.locations is not None and (
+            apartment.location.strip().casefold() not in self.locations
+        ):
+            return False
+        if (
+            self.sizes is not None
+            and apartment.size.strip().casefold() not in self.sizes
+        ):
+            return False
+        if self.free_from_after is not None and (
+            apartment.free_from < self.free_from_after
+        ):
+            return False
+        if self.free_from_before is not None and (
+            apartment.free_from > self.free_from_before
+        ):
+            return False
+        return True
+
+
+def _normalized(values: list[str] | None) -> frozenset[str] | None:
+    if not values:
+        return None
+    return frozenset(value.strip().casefold() for value in values)
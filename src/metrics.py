@@ -0,0 +1,130 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        # the last count collects the observations above the largest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self) -> list[tuple[str, int]]:
+        total = 0
+        counts = []
+        for bound, count in zip((*self.buckets, "+Inf"), self.counts):
+            total += count
+            counts.append((str(bound), total))
+        return counts
+
+
+class Metrics:
+    PREFIX = "sgs_bot"
+
+    def __init__(self) -> None:
+        self.started = datetime.now()
+        self.stages: dict[str, float] = {}
+        self.counters = Counter()
+        self.histograms: dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+        self._nested = threading.local()
+
+    @contextmanager
+    def stage(self, name):
+        # the time of a nested stage is not counted again in the stage around it,
+        # so that the stages add up to the time of the run
+        nested_seconds = self._nested.__dict__.setdefault("seconds", [])
+        nested_seconds.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            exclusive = elapsed - nested_seconds.pop()
+            if len(nested_seconds) > 0:
+                nested_seconds[-1] += elapsed
+            with self._lock:
+                self.stages[name] = self.stages.get(name, 0) + exclusive
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def observe(self, name, value):
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].observe(value)
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                "started": self.started.isoformat(),
+                "duration_seconds": (datetime.now() - self.started).total_seconds(),
+                "stages": dict(self.stages),
+                "counters": dict(self.counters),
+                "histograms": {
+                    name: {
+                        "buckets": dict(histogram.cumulative_counts()),
+                        "sum": histogram.sum,
+                        "count": histogram.count,
+                    }
+                    for name, histogram in self.histograms.items()
+                },
+            }
+
+    def to_prometheus(self) -> str:
+        report = self.report()
+        lines = [
+            f"# TYPE {self.PREFIX}_stage_seconds gauge",
+            *(
+                f'{self.PREFIX}_stage_seconds{{stage="{stage}"}} {seconds}'
+                for stage, seconds in report["stages"].items()
+            ),
+            f"# TYPE {self.PREFIX}_run_seconds gauge",
+            f"{self.PREFIX}_run_seconds {report['duration_seconds']}",
+        ]
+        for name, value in report["counters"].items():
+            lines.append(f"# TYPE {self.PREFIX}_{name} gauge")
+            lines.append(f"{self.PREFIX}_{name} {value}")
+        for name, histogram in report["histograms"].items():
+            lines.append(f"# TYPE {self.PREFIX}_{name} histogram")
+            lines.extend(
+                f'{self.PREFIX}_{name}_bucket{{le="{bound}"}} {count}'
+                for bound, count in histogram["buckets"].items()
+            )
+            lines.append(f"{self.PREFIX}_{name}_sum {histogram['sum']}")
+            lines.append(f"{self.PREFIX}_{name}_count {histogram['count']}")
+
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, path):
+        _write_atomically(path, json.dumps(self.report(), indent=2))
+
+    def write_prometheus(self, path):
+        _write_atomically(path, self.to_prometheus())
+
+
+def _write_atomically(path, content):
+    # readers such as the node exporter never see a partially written file
+    directory = os.path.dirname(path) or "."
+    with tempfile.NamedTemporaryFile(
+        "w", encoding="utf-8", dir=directory, delete=False
+    ) as f:
+        f.write(content)
+    os.replace(f.name, path)
@@ -0,0 +1,91 @@
+from dataclasses import dataclass
+from html import escape
+from string import Template
+
+TEXT_FRAGMENT = Template("""$address - $location (free from $free_from):
+$size | ${area}m² | $rent SEK
+$distances
+$url
+""")
+
+HTML_FRAGMENT = Template("""<li>
+<p><a href="$url"><strong>$address</strong></a> - $location (free from $free_from)</p>
+<p>$size | ${area}m² | $rent SEK</p>
+<p>$distances</p>
+</li>""")
+
+HTML_DIGEST = Template("""<!DOCTYPE html>
+<html>
+<body>
+<ul>
+$fragments
+</ul>
+</body>
+</html>
+""")
+
+
+@dataclass(frozen=True)
+class Fragment:
+    text: str
+    html: str
+
+
+@dataclass(frozen=True)
+class Digest:
+    text: str
+    html: str
+    apartments: int
+
+
+class MailRenderer:
+    def __init__(self) -> None:
+        self.fragments: dict[tuple, Fragment] = {}
+
+    def render_digest(self, apartment_dict) -> Digest:
+        fragments = [
+            self.render_fragment(apartment, distances)
+            for apartment, distances in apartment_dict.items()
+        ]
+        return Digest(
+            text="\n".join(fragment.text for fragment in fragments),
+            html=HTML_DIGEST.substitute(
+                fragments="\n".join(fragment.html for fragment in fragments)
+            ),
+            apartments=len(fragments),
+        )
+
+    def render_fragment(self, apartment, distances) -> Fragment:
+        times = tuple(
+            sorted(
+                (destination.destination, distance.time)
+                for destination, distance in distances.items()
+                if distance is not None
+            )
+        )
+        # subscribers sharing the same destinations share the rendered apartment
+        key = (apartment.id, times)
+        if key not in self.fragments:
+            self.fragments[key] = _render(apartment, times)
+        return self.fragments[key]
+
+
+def _render(apartment, times) -> Fragment:
+    fields = {
+        "address": apartment.address,
+        "location": apartment.location,
+        "free_from": f"{apartment.free_from.day} {apartment.free_from:%b}",
+        "size": apartment.size,
+        "area": apartment.area,
+        "rent": apartment.rent,
+        "url": apartment.url,
+    }
+    distances = [f"To {destination}: {time}min" for destination, time in times]
+
+    return Fragment(
+        text=TEXT_FRAGMENT.substitute(fields, distances=" | ".join(distances)),
+        html=HTML_FRAGMENT.substitute(
+            {name: escape(str(value)) for name, value in fields.items()},
+            distances=" | ".join(escape(distance) for distance in distances),
+        ),
+    )
@@ -0,0 +1,113 @@
+import logging
+import random
+import threading
+from datetime import datetime, timedelta
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+
+class InvalidCronExpression(Exception):
+    pass
+
+
+class IntervalSchedule:
+    def __init__(self, interval: timedelta, jitter: timedelta) -> None:
+        self.interval = interval
+        self.jitter = jitter
+
+    def next_run(self, after: datetime) -> datetime:
+        return after + self.interval + _random_jitter(self.jitter)
+
+
+class CronSchedule:
+    FIELD_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expression: str, jitter: timedelta) -> None:
+        fields = expression.split()
+        if len(fields) != 5:
+            raise InvalidCronExpression(
+                f"'{expression}' must have 5 fields: minute hour day month weekday"
+            )
+
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            _parse_cron_field(field, *field_range)
+            for field, field_range in zip(fields, self.FIELD_RANGES)
+        )
+        # cron allows both 0 and 7 for sunday
+        self.weekdays = {weekday % 7 for weekday in weekdays}
+        self.days_restricted = fields[2] != "*"
+        self.weekdays_restricted = fields[4] != "*"
+        self.jitter = jitter
+
+    def next_run(self, after: datetime) -> datetime:
+        run = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = run + timedelta(days=366 * 5)
+
+        while run < limit:
+            if run.month not in self.months:
+                run = (run.replace(day=1) + timedelta(days=32)).replace(
+                    day=1, hour=0, minute=0
+                )
+            elif not self._matches_day(run):
+                run = run.replace(hour=0, minute=0) + timedelta(days=1)
+            elif run.hour not in self.hours:
+                run = run.replace(minute=0) + timedelta(hours=1)
+            elif run.minute not in self.minutes:
+                run += timedelta(minutes=1)
+            else:
+                return run + _random_jitter(self.jitter)
+
+        raise InvalidCronExpression("The cron expression never matches.")
+
+    def _matches_day(self, run: datetime) -> bool:
+        day_matches = run.day in self.days
+        weekday_matches = (run.weekday() + 1) % 7 in self.weekdays
+
+        # like cron, a restricted day and weekday match if either of them does
+        if self.days_restricted and self.weekdays_restricted:
+            return day_matches or weekday_matches
+        return day_matches and weekday_matches
+
+
+def _parse_cron_field(field, minimum, maximum) -> set[int]:
+    values = set()
+    try:
+        for part in field.split(","):
+            part, _, step = part.partition("/")
+            if part == "*":
+                start, end = minimum, maximum
+            elif "-" in part:
+                start, end = (int(value) for value in part.split("-"))
+            else:
+                start = int(part)
+                end = maximum if step else start
+
+            if not minimum <= start <= end <= maximum:
+                raise InvalidCronExpression(f"'{field}' is out of range.")
+
+            values.update(range(start, end + 1, int(step) if step else 1))
+    except ValueError:
+        raise InvalidCronExpression(f"'{field}' is not a valid cron field.") from None
+
+    return values
+
+
+def _random_jitter(jitter: timedelta) -> timedelta:
+    return timedelta(seconds=random.uniform(0, jitter.total_seconds()))
+
+
+def run_scheduled(schedule, job, stop: threading.Event):
+    while not stop.is_set():
+        next_run = schedule.next_run(datetime.now())
+        log.info("next run at %s", next_run)
+
+        if stop.wait(max((next_run - datetime.now()).total_seconds(), 0)):
+            break
+
+        try:
+            job()
+        except Exception:
+            log.error("Scheduled run failed.", exc_info=True)
+
+    log.info("scheduler stopped")
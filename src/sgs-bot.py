@@ -1,34 +1,72 @@
 import argparse
+import functools
+import hashlib
 import logging
 import os
-import sys
+import signal
+import threading
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, timedelta
+from itertools import islice
 
-from sqlalchemy import and_, create_engine, delete, event, select, update
+import requests
+from sqlalchemy import (
+    and_,
+    case,
+    create_engine,
+    delete,
+    event,
+    func,
+    or_,
+    select,
+    update,
+)
 from sqlalchemy.dialects.sqlite import insert
 from sqlalchemy.engine import Engine
 from sqlalchemy.orm import Session
+from sqlalchemy.pool import QueuePool
 
+from cache import VasttrafikCache
 from database import (
     Apartment,
     Base,
     Destination,
     Distance,
+    OutboxMessage,
+    Place,
     SubscribedApartments,
     Subscription,
+    get_place_key,
+    migrate,
 )
-from mail import MailSendException, MailServer, SMTPServerConfig
+from geo import GeoGrid, reachable_distance_km
+from mail import MailServer, SMTPServerConfig
+from matcher import SubscriptionCriteria, SubscriptionMatcher
+from metrics import Metrics
+from render import MailRenderer
+from scheduler import CronSchedule, IntervalSchedule, run_scheduled
 from sgs import SGS
-from vasttrafik import VasttrafikAPI
-from webdriver import get_webdriver
+from vasttrafik import (
+    PRIORITY_NEW,
+    PRIORITY_REFRESH,
+    JourneyNotFoundException,
+    LocationNotFoundException,
+    RateLimiter,
+    TokenProvider,
+    VasttrafikAPI,
+)
+from webdriver import WebDriverPool
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
+RUN_REPORT_FILE = "run_report.json"
+MAX_DELIVERY_BACKOFF = timedelta(hours=6)
 
-@dataclass
+
+@dataclass(frozen=True)
 class Config:
     data_root: str
     vasttrafik_api_key: str
@@ -36,6 +74,20 @@ class Config:
     smtp_port: str
     smtp_user: str
     smtp_password: str
+    cache_ttl_hours: int = 168
+    cache_max_entries: int = 100000
+    sqlite_journal_mode: str = "WAL"
+    sqlite_synchronous: str = "NORMAL"
+    sqlite_cache_size: int = -20000
+    sqlite_mmap_size: int = 268435456
+    sqlite_busy_timeout: int = 5000
+    sqlite_pool_size: int = 5
+    vasttrafik_rate: float = 10
+    vasttrafik_burst: int = 10
+    vasttrafik_url: str = VasttrafikAPI.BASE_URL
+    vasttrafik_token_url: str = TokenProvider.URL
+    sgs_url: str = SGS.URL
+    smtp_ssl: bool = True
 
 
 class MissingEnvironmentVariable(Exception):
@@ -62,6 +114,24 @@ def load_config():
             smtp_user=smtp_user,
             smtp_password=smtp_password,
             vasttrafik_api_key=vasttrafik_api_key,
+            cache_ttl_hours=int(os.environ.get("VASTTRAFIK_CACHE_TTL_HOURS", 168)),
+            cache_max_entries=int(
+                os.environ.get("VASTTRAFIK_CACHE_MAX_ENTRIES", 100000)
+            ),
+            sqlite_journal_mode=os.environ.get("SQLITE_JOURNAL_MODE", "WAL"),
+            sqlite_synchronous=os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL"),
+            sqlite_cache_size=int(os.environ.get("SQLITE_CACHE_SIZE", -20000)),
+            sqlite_mmap_size=int(os.environ.get("SQLITE_MMAP_SIZE", 268435456)),
+            sqlite_busy_timeout=int(os.environ.get("SQLITE_BUSY_TIMEOUT", 5000)),
+            sqlite_pool_size=int(os.environ.get("SQLITE_POOL_SIZE", 5)),
+            vasttrafik_rate=float(os.environ.get("VASTTRAFIK_RATE", 10)),
+            vasttrafik_burst=int(os.environ.get("VASTTRAFIK_BURST", 10)),
+            vasttrafik_url=os.environ.get("VASTTRAFIK_URL", VasttrafikAPI.BASE_URL),
+            vasttrafik_token_url=os.environ.get(
+                "VASTTRAFIK_TOKEN_URL", TokenProvider.URL
+            ),
+            sgs_url=os.environ.get("SGS_URL", SGS.URL),
+            smtp_ssl=os.environ.get("SMTP_SSL", "true").lower() == "true",
         )
 
     except KeyError as e:
@@ -71,18 +141,69 @@ def load_config():
         ) from None
 
 
-def store_appartments(session, apartments):
-    for apartment in apartments:
-        statement = (
-            insert(Apartment).values(**apartment.__dict__).on_conflict_do_nothing()
-        )
-        session.execute(statement)
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
 
-    session.commit()
 
+def execute_chunked(session, statement, rows, chunk_size):
+    for chunk in chunked(rows, chunk_size):
+        session.execute(statement, chunk)
 
-def get_filtered_apartments(session: Session):
-    statement = (
+
+def content_hash(apartment):
+    content = "|".join(
+        str(value) for key, value in apartment.__dict__.items() if key != "id"
+    )
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def store_appartments(session, apartments, seen, chunk_size):
+    statement = insert(Apartment)
+    changed = Apartment.content_hash.is_distinct_from(statement.excluded.content_hash)
+    statement = statement.on_conflict_do_update(
+        index_elements=[Apartment.id],
+        set_={
+            **{
+                column: statement.excluded[column]
+                for column in ("address", "location", "size", "area", "rent")
+            },
+            "free_from": statement.excluded.free_from,
+            "url": statement.excluded.url,
+            "content_hash": statement.excluded.content_hash,
+            "first_seen": func.coalesce(
+                Apartment.first_seen, statement.excluded.first_seen
+            ),
+            "last_seen": statement.excluded.last_seen,
+            "updated": case(
+                (changed, statement.excluded.updated),
+                else_=Apartment.updated,
+            ),
+            # a changed listing may have a new address, so it is located again
+            "latitude": case((changed, None), else_=Apartment.latitude),
+            "longitude": case((changed, None), else_=Apartment.longitude),
+        },
+    )
+    execute_chunked(
+        session,
+        statement,
+        [
+            {
+                **apartment.__dict__,
+                "content_hash": content_hash(apartment),
+                "first_seen": seen,
+                "last_seen": seen,
+                "updated": seen,
+            }
+            for apartment in apartments
+        ],
+        chunk_size,
+    )
+
+
+def filtered_apartments_statement(seen):
+    return (
         select(Apartment, Subscription, Destination, SubscribedApartments)
         .join(
             Destination,
@@ -101,48 +222,370 @@ def get_filtered_apartments(session: Session):
         .where(Apartment.area > Subscription.min_area)
         .where(Apartment.rent < Subscription.max_rent)
         .where(SubscribedApartments.notified.is_not(True))
+        .where(Apartment.last_seen >= seen)
+        .where(
+            or_(
+                Subscription.last_matched.is_(None),
+                Apartment.updated > Subscription.last_matched,
+            )
+        )
     )
-    result = session.execute(statement)
+
+
+def get_filtered_apartments(session: Session, seen):
+    result = session.execute(filtered_apartments_statement(seen))
     return result.all()
 
 
-def store_duration(session, apartment, destination, duration):
-    statement = (
-        insert(Distance)
-        .values(
-            {
-                "apartment_id": apartment.id,
-                "destination_id": destination.id,
-                "time": duration,
-            }
+def match_in_memory(session: Session, seen):
+    subscriptions = session.execute(
+        select(
+            Subscription.id,
+            Subscription.min_area,
+            Subscription.max_rent,
+            Subscription.last_matched,
         )
-        .on_conflict_do_update(
-            set_={Distance.time: duration},
+    ).all()
+    listed_apartments = session.execute(
+        select(Apartment.id, Apartment.area, Apartment.rent, Apartment.updated).where(
+            Apartment.last_seen >= seen
+        )
+    ).all()
+
+    new_subscriptions = [
+        subscription[:3]
+        for subscription in subscriptions
+        if subscription.last_matched is None
+    ]
+    matches = SubscriptionMatcher(new_subscriptions).match(
+        apartment[:3] for apartment in listed_apartments
+    )
+
+    last_matched = {
+        subscription.id: subscription.last_matched
+        for subscription in subscriptions
+        if subscription.last_matched is not None
+    }
+    if len(last_matched) > 0:
+        changed_since = min(last_matched.values())
+        updated = {
+            apartment.id: apartment.updated
+            for apartment in listed_apartments
+            if apartment.updated > changed_since
+        }
+        matches.extend(
+            (apartment_id, subscription_id)
+            for apartment_id, subscription_id in SubscriptionMatcher(
+                subscription[:3]
+                for subscription in subscriptions
+                if subscription.id in last_matched
+            ).match(
+                apartment[:3]
+                for apartment in listed_apartments
+                if apartment.id in updated
+            )
+            if updated[apartment_id] > last_matched[subscription_id]
         )
+
+    notified = set(
+        session.execute(
+            select(
+                SubscribedApartments.apartment_id, SubscribedApartments.subscription_id
+            )
+            .join(Apartment)
+            .where(Apartment.last_seen >= seen)
+            .where(SubscribedApartments.notified == True)
+        ).all()
     )
-    session.execute(statement)
-    session.commit()
+    return [match for match in matches if match not in notified]
 
 
-def store_subscribed_apartment(session, apartment, subscription):
-    statement = (
-        insert(SubscribedApartments)
-        .values(
+def get_matches(session: Session, seen, matcher):
+    if matcher == "memory":
+        return match_in_memory(session, seen)
+
+    return list(
+        {
+            (apartment.id, subscription.id)
+            for apartment, subscription, _, _ in get_filtered_apartments(session, seen)
+        }
+    )
+
+
+def filter_by_criteria(session: Session, matches, seen):
+    subscriptions = session.execute(
+        select(Subscription).where(
+            or_(
+                Subscription.locations.is_not(None),
+                Subscription.sizes.is_not(None),
+                Subscription.free_from_after.is_not(None),
+                Subscription.free_from_before.is_not(None),
+            )
+        )
+    ).scalars()
+    criteria = {
+        subscription.id: SubscriptionCriteria.from_subscription(subscription)
+        for subscription in subscriptions
+    }
+    if len(criteria) == 0:
+        return matches
+
+    apartments = {
+        apartment.id: apartment
+        for apartment in session.execute(
+            select(
+                Apartment.id, Apartment.location, Apartment.size, Apartment.free_from
+            ).where(Apartment.last_seen >= seen)
+        )
+    }
+    return [
+        (apartment_id, subscription_id)
+        for apartment_id, subscription_id in matches
+        if subscription_id not in criteria
+        or criteria[subscription_id].accepts(apartments[apartment_id])
+    ]
+
+
+def geocode(vasttrafik, searches, workers):
+    searches = list(set(searches))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        locations = executor.map(
+            lambda search: _try_vasttrafik(vasttrafik.get_location, search),
+            searches,
+        )
+        return {
+            search: location
+            for search, location in zip(searches, locations)
+            if location is not None
+        }
+
+
+def locate_apartments(session: Session, vasttrafik, matches, seen, workers):
+    # only a commute limit to some destination can rule an apartment out by distance
+    limited_subscriptions = set(
+        session.execute(
+            select(Subscription.id)
+            .join(Destination, Destination.subscription_id == Subscription.id)
+            .where(Subscription.max_commute.is_not(None))
+            .distinct()
+        )
+        .scalars()
+        .all()
+    )
+    matched_ids = {
+        apartment_id
+        for apartment_id, subscription_id in matches
+        if subscription_id in limited_subscriptions
+    }
+    if len(matched_ids) == 0:
+        return
+
+    addresses = {
+        apartment_id: address
+        for apartment_id, address in session.execute(
+            select(Apartment.id, Apartment.address)
+            .where(Apartment.last_seen >= seen)
+            .where(Apartment.latitude.is_(None))
+        )
+        if apartment_id in matched_ids
+    }
+    locations = geocode(vasttrafik, addresses.values(), workers)
+
+    coordinates = [
+        {
+            "id": apartment_id,
+            "latitude": locations[address].latitude,
+            "longitude": locations[address].longitude,
+        }
+        for apartment_id, address in addresses.items()
+        if address in locations
+    ]
+    if len(coordinates) > 0:
+        session.execute(update(Apartment), coordinates)
+
+
+def locate_places(session: Session, vasttrafik, workers):
+    places = dict(
+        session.execute(
+            select(Place.id, Place.name).where(Place.latitude.is_(None))
+        ).all()
+    )
+    locations = geocode(vasttrafik, places.values(), workers)
+
+    coordinates = [
+        {
+            "id": place_id,
+            "latitude": locations[name].latitude,
+            "longitude": locations[name].longitude,
+        }
+        for place_id, name in places.items()
+        if name in locations
+    ]
+    if len(coordinates) > 0:
+        session.execute(update(Place), coordinates)
+
+
+def filter_by_distance(session: Session, matches, seen):
+    max_commutes = dict(
+        session.execute(
+            select(Subscription.id, Subscription.max_commute).where(
+                Subscription.max_commute.is_not(None)
+            )
+        ).all()
+    )
+    if len(max_commutes) == 0:
+        return matches
+
+    grid = GeoGrid()
+    located_apartments = set()
+    for apartment_id, latitude, longitude in session.execute(
+        select(Apartment.id, Apartment.latitude, Apartment.longitude)
+        .where(Apartment.last_seen >= seen)
+        .where(Apartment.latitude.is_not(None))
+    ):
+        grid.add(apartment_id, latitude, longitude)
+        located_apartments.add(apartment_id)
+
+    reachable = {}
+    for subscription_id, latitude, longitude in session.execute(
+        select(Destination.subscription_id, Place.latitude, Place.longitude)
+        .join(Place)
+        .where(Destination.subscription_id.in_(max_commutes.keys()))
+        .where(Place.latitude.is_not(None))
+    ):
+        nearby = grid.within(
+            latitude,
+            longitude,
+            reachable_distance_km(max_commutes[subscription_id]),
+        )
+        if subscription_id not in reachable:
+            reachable[subscription_id] = nearby
+        else:
+            reachable[subscription_id] &= nearby
+
+    # apartments without coordinates cannot be ruled out by distance
+    return [
+        (apartment_id, subscription_id)
+        for apartment_id, subscription_id in matches
+        if subscription_id not in reachable
+        or apartment_id not in located_apartments
+        or apartment_id in reachable[subscription_id]
+    ]
+
+
+def filter_by_commute(session: Session, matches, destinations, durations):
+    max_commutes = dict(
+        session.execute(
+            select(Subscription.id, Subscription.max_commute).where(
+                Subscription.max_commute.is_not(None)
+            )
+        ).all()
+    )
+
+    def within_commute(apartment_id, subscription_id):
+        if subscription_id not in max_commutes:
+            return True
+        # journeys that could not be planned do not reject an apartment
+        return all(
+            durations.get((apartment_id, place_id), 0) <= max_commutes[subscription_id]
+            for place_id, _ in destinations[subscription_id]
+        )
+
+    return [match for match in matches if within_commute(*match)]
+
+
+def get_listed_addresses(session: Session, seen):
+    return dict(
+        session.execute(
+            select(Apartment.id, Apartment.address).where(Apartment.last_seen >= seen)
+        ).all()
+    )
+
+
+def get_new_listings(session: Session, seen):
+    return set(
+        session.execute(select(Apartment.id).where(Apartment.first_seen >= seen))
+        .scalars()
+        .all()
+    )
+
+
+def get_destinations(session: Session):
+    destinations = defaultdict(list)
+    for subscription_id, place_id, name in session.execute(
+        select(Destination.subscription_id, Place.id, Place.name).join(Place)
+    ):
+        destinations[subscription_id].append((place_id, name))
+    return destinations
+
+
+def _try_vasttrafik(function, *params):
+    try:
+        return function(*params)
+    except (
+        LocationNotFoundException,
+        JourneyNotFoundException,
+        requests.RequestException,
+    ):
+        log.warning("Västtrafik request for %s failed.", params, exc_info=True)
+        return None
+
+
+def plan_durations(vasttrafik, priorities, workers):
+    # journeys for new listings are submitted, and rate limited, first
+    pairs = sorted(priorities, key=priorities.get)
+    searches = {search for pair in pairs for search in pair}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # resolve every address once up front, so that parallel journeys sharing
+        # an origin or destination do not geocode it concurrently
+        list(
+            executor.map(
+                lambda search: _try_vasttrafik(vasttrafik.get_location, search),
+                searches,
+            )
+        )
+
+        durations = executor.map(
+            lambda pair: _try_vasttrafik(
+                vasttrafik.get_planned_duration, *pair, priorities[pair]
+            ),
+            pairs,
+        )
+        return {
+            pair: duration.total_seconds() / 60
+            for pair, duration in zip(pairs, durations)
+            if duration is not None
+        }
+
+
+def store_durations(session, durations, chunk_size):
+    statement = insert(Distance)
+    statement = statement.on_conflict_do_update(
+        index_elements=[Distance.apartment_id, Distance.place_id],
+        set_={Distance.time: statement.excluded.time},
+    )
+    execute_chunked(session, statement, durations, chunk_size)
+
+
+def store_subscribed_apartments(session, subscribed_apartments, chunk_size):
+    execute_chunked(
+        session,
+        insert(SubscribedApartments).on_conflict_do_nothing(),
+        [
             {
-                "apartment_id": apartment.id,
-                "subscription_id": subscription.id,
+                "apartment_id": apartment_id,
+                "subscription_id": subscription_id,
                 "notified": False,
             }
-        )
-        .on_conflict_do_nothing()
+            for apartment_id, subscription_id in subscribed_apartments
+        ],
+        chunk_size,
     )
 
-    session.execute(statement)
-    session.commit()
-
 
-def get_new_apartments(session):
-    statement = (
+def new_apartments_statement():
+    return (
         select(Subscription, Apartment, Distance, Destination)
         .join(
             SubscribedApartments,
@@ -152,18 +595,29 @@ def get_new_apartments(session):
             Apartment,
             SubscribedApartments.apartment_id == Apartment.id,
         )
-        .join(Distance, isouter=True)
         .join(
             Destination,
+            Destination.subscription_id == Subscription.id,
+            isouter=True,
+        )
+        .join(
+            Distance,
             and_(
-                Destination.id == Distance.destination_id,
-                Destination.subscription_id == Subscription.id,
+                Distance.apartment_id == Apartment.id,
+                Distance.place_id == Destination.place_id,
             ),
             isouter=True,
         )
         .where(SubscribedApartments.notified == False)
     )
-    return session.execute(statement).all()
+
+
+def store_matched_subscriptions(session, matched):
+    session.execute(update(Subscription).values(last_matched=matched))
+
+
+def get_new_apartments(session):
+    return session.execute(new_apartments_statement()).all()
 
 
 def get_notification(apartments):
@@ -176,18 +630,7 @@ def get_notification(apartments):
     return notifications
 
 
-def format_mail(apartment_dict):
-    return [
-        f"""{apartment.address} - {apartment.location} (free from {datetime.strftime(apartment.free_from, "%-d %b")}):
-{apartment.size} | {apartment.area}m² | {apartment.rent} SEK
-{" | ".join([f"To {destination.destination}: {distance.time}min" for destination, distance in distances.items() if destination is not None])}
-{apartment.url}
-"""
-        for apartment, distances in apartment_dict.items()
-    ]
-
-
-def store_sent_apartments(session, apartment_dict, subscription, value):
+def store_notified_apartments(session, apartment_dict, subscription):
     statement = (
         update(SubscribedApartments)
         .where(
@@ -196,56 +639,271 @@ def store_sent_apartments(session, apartment_dict, subscription, value):
             )
         )
         .where(SubscribedApartments.subscription_id == subscription.id)
-        .values(notified=value)
+        .values(notified=True)
     )
 
     session.execute(statement)
-    session.commit()
 
 
-def get_db_engine(data_root):
-    engine = create_engine(f"sqlite:///{os.path.join(data_root, 'database.db')}")
+def enqueue_notifications(session: Session, notifications, renderer: MailRenderer):
+    queued = 0
+    for subscription, apartment_dict in notifications.items():
+        digest = renderer.render_digest(apartment_dict)
+
+        log.info(
+            "found %(number)s new apartments to send to %(email)s",
+            {"number": digest.apartments, "email": subscription.email},
+        )
+        if digest.apartments > 0:
+            session.add(
+                OutboxMessage(
+                    receiver=subscription.email,
+                    subject="New SGS apartments",
+                    content=digest.text,
+                    html=digest.html,
+                )
+            )
+            store_notified_apartments(session, apartment_dict, subscription)
+            queued += 1
+
+    return queued
+
+
+def get_pending_messages(session: Session, now):
+    return session.execute(
+        select(
+            OutboxMessage.id,
+            OutboxMessage.receiver,
+            OutboxMessage.subject,
+            OutboxMessage.content,
+            OutboxMessage.html,
+            OutboxMessage.attempts,
+        )
+        .where(OutboxMessage.sent.is_(None))
+        .where(
+            or_(
+                OutboxMessage.next_attempt.is_(None),
+                OutboxMessage.next_attempt <= now,
+            )
+        )
+        .order_by(OutboxMessage.id)
+    ).all()
+
+
+def count_overdue_messages(session: Session, max_attempts):
+    return session.execute(
+        select(func.count())
+        .select_from(OutboxMessage)
+        .where(OutboxMessage.sent.is_(None))
+        .where(OutboxMessage.attempts >= max_attempts)
+    ).scalar_one()
+
+
+def get_delivery_delay(attempts, backoff):
+    # failed messages are retried less and less often, but never given up, as
+    # their apartments are already marked as notified
+    return min(backoff * 2 ** (attempts - 1), MAX_DELIVERY_BACKOFF)
+
+
+def get_database_path(data_root):
+    return os.path.join(data_root, "database.db")
+
+
+def get_db_engine(config):
+    engine = create_engine(
+        f"sqlite:///{get_database_path(config.data_root)}",
+        poolclass=QueuePool,
+        pool_size=config.sqlite_pool_size,
+    )
+
+    @event.listens_for(engine, "connect")
+    def set_engine_pragmas(dbapi_connection, _connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={config.sqlite_journal_mode}")
+        cursor.execute(f"PRAGMA synchronous={config.sqlite_synchronous}")
+        cursor.execute(f"PRAGMA cache_size={config.sqlite_cache_size}")
+        cursor.execute(f"PRAGMA mmap_size={config.sqlite_mmap_size}")
+        cursor.execute(f"PRAGMA busy_timeout={config.sqlite_busy_timeout}")
+        cursor.close()
+
     Base.metadata.create_all(engine)
+    migrate(engine)
 
     return engine
 
 
-def crawl(config, engine, _args):
-    try:
-        webdriver = get_webdriver(headless=True)
+@functools.cache
+def get_webdriver_pool(size, max_pages, max_memory_mb):
+    return WebDriverPool(size, max_pages=max_pages, max_memory_mb=max_memory_mb)
+
+
+def scrape_apartments(webdriver_pool, url=SGS.URL):
+    log.info("opening SGS website...")
+    yield from SGS(webdriver_pool, url).iter_apartments()
+
 
-        log.info("opening SGS website...")
-        crawled_apartments = SGS(webdriver).get_apartments()
-    except Exception:
-        log.error("Failed.", exc_info=True)
-        sys.exit(1)
+@functools.cache
+def get_vasttrafik_cache(config, engine):
+    return VasttrafikCache(
+        engine,
+        ttl=timedelta(hours=config.cache_ttl_hours),
+        max_entries=config.cache_max_entries,
+    )
+
+
+@functools.cache
+def get_vasttrafik_api(config, engine, workers):
+    return VasttrafikAPI(
+        config.vasttrafik_api_key,
+        config.data_root,
+        cache=get_vasttrafik_cache(config, engine),
+        pool_size=workers,
+        rate_limiter=RateLimiter(config.vasttrafik_rate, config.vasttrafik_burst),
+        base_url=config.vasttrafik_url,
+        token_url=config.vasttrafik_token_url,
+    )
+
+
+def crawl(config, engine, args):
+    metrics = Metrics()
+    try:
+        _crawl(config, engine, args, metrics)
     finally:
-        webdriver.quit()
+        log.info("crawl stages: %s", metrics.stages)
+        metrics.write_report(os.path.join(config.data_root, RUN_REPORT_FILE))
+        if args.prometheus_file is not None:
+            metrics.write_prometheus(args.prometheus_file)
+
 
+def _crawl(config, engine, args, metrics: Metrics):
+    seen = datetime.now()
     with Session(engine) as session:
         log.info("storing all apartments...")
-        store_appartments(session, crawled_apartments)
-        rows = get_filtered_apartments(session)
-
-        log.info("calculate distances for %s combinations", len(rows))
-        vasttrafik = VasttrafikAPI(config.vasttrafik_api_key, config.data_root)
-        for apartment, subscription, destination, _ in rows:
-            if destination is not None:
-                duration = (
-                    vasttrafik.get_planned_duration(
-                        apartment.address, destination.destination
-                    ).total_seconds()
-                    / 60
+        # starting the browsers and storing the chunks run inside the scrape, and
+        # are timed as stages of their own
+        with metrics.stage("scrape"):
+            webdriver_pool = get_webdriver_pool(
+                args.browsers, args.max_browser_pages, args.max_browser_memory
+            )
+            # the pool is shared by every crawl of the process, so it reports its
+            # launches to the metrics of the current one
+            webdriver_pool.launch_stage = lambda: metrics.stage("browser_launch")
+            scraped_apartments = scrape_apartments(webdriver_pool, config.sgs_url)
+            for apartments in chunked(scraped_apartments, args.chunk_size):
+                with metrics.stage("store_apartments"):
+                    store_appartments(session, apartments, seen, args.chunk_size)
+                metrics.increment("apartments_written", len(apartments))
+        with metrics.stage("store_apartments"):
+            session.commit()
+
+        with metrics.stage("match"):
+            matches = get_matches(session, seen, args.matcher)
+            matches = filter_by_criteria(session, matches, seen)
+        metrics.increment("matches", len(matches))
+
+        log.info("found %s new matches", len(matches))
+        cache = get_vasttrafik_cache(config, engine)
+        if len(matches) > 0:
+            vasttrafik = get_vasttrafik_api(config, engine, args.workers)
+            vasttrafik.clear_memory_cache()
+
+            with metrics.stage("geocode"):
+                # the workers persist their lookups through their own connections,
+                # so no write transaction may stay open while they run
+                locate_apartments(session, vasttrafik, matches, seen, args.workers)
+                session.commit()
+                locate_places(session, vasttrafik, args.workers)
+                session.commit()
+                matches = filter_by_distance(session, matches, seen)
+            log.info("%s matches are within reach", len(matches))
+
+            addresses = get_listed_addresses(session, seen)
+            destinations = get_destinations(session)
+            # subscribers sharing a place share its journeys
+            journeys = {
+                (apartment_id, place_id, addresses[apartment_id], name)
+                for apartment_id, subscription_id in matches
+                for place_id, name in destinations[subscription_id]
+            }
+
+            log.info("calculate distances for %s combinations", len(journeys))
+            new_listings = get_new_listings(session, seen)
+            priorities = {}
+            for apartment_id, _, address, name in journeys:
+                priority = (
+                    PRIORITY_NEW if apartment_id in new_listings else PRIORITY_REFRESH
                 )
-                store_duration(session, apartment, destination, duration)
+                priorities[(address, name)] = min(
+                    priority, priorities.get((address, name), priority)
+                )
+            with metrics.stage("plan_journeys"):
+                planned_durations = plan_durations(vasttrafik, priorities, args.workers)
+            durations = {
+                (apartment_id, place_id): planned_durations[(address, name)]
+                for apartment_id, place_id, address, name in journeys
+                if (address, name) in planned_durations
+            }
+            with metrics.stage("store_matches"):
+                store_durations(
+                    session,
+                    [
+                        {
+                            "apartment_id": apartment_id,
+                            "place_id": place_id,
+                            "time": duration,
+                        }
+                        for (apartment_id, place_id), duration in durations.items()
+                    ],
+                    args.chunk_size,
+                )
+
+                matches = filter_by_commute(session, matches, destinations, durations)
+                store_subscribed_apartments(session, matches, args.chunk_size)
+            metrics.increment("distances_written", len(durations))
+            metrics.increment("subscribed_apartments_written", len(matches))
 
-            store_subscribed_apartment(session, apartment, subscription)
+            counters, latencies = vasttrafik.drain_metrics()
+            log.info("Västtrafik requests: %s", dict(counters))
+            for counter, value in counters.items():
+                metrics.increment(f"vasttrafik_{counter}", value)
+            for latency in latencies:
+                metrics.observe("vasttrafik_latency_seconds", latency)
+
+        store_matched_subscriptions(session, seen)
+        session.commit()
+
+        cache.evict()
 
         log.info("prepare notification")
 
-        new_apartments = get_new_apartments(session)
+        with metrics.stage("render"):
+            new_apartments = get_new_apartments(session)
+            # the apartments are marked as notified in the same transaction that
+            # queues their message, so that none is lost or queued twice
+            queued = enqueue_notifications(
+                session, get_notification(new_apartments), MailRenderer()
+            )
+            session.commit()
+        metrics.increment("messages_queued", queued)
 
-    notifications = get_notification(new_apartments)
+    with metrics.stage("deliver"):
+        results = deliver(config, engine, args)
+    metrics.increment("mails_sent", sum(result.sent for result in results))
+    metrics.increment("mails_failed", sum(not result.sent for result in results))
+    with Session(engine) as session:
+        metrics.increment(
+            "messages_overdue",
+            count_overdue_messages(session, args.max_delivery_attempts),
+        )
+
+
+def deliver(config, engine, args):
+    with Session(engine) as session:
+        messages = get_pending_messages(session, datetime.now())
+
+    log.info("%s messages waiting in the outbox", len(messages))
+    if len(messages) == 0:
+        return []
 
     mail_server = MailServer(
         SMTPServerConfig(
@@ -253,31 +911,67 @@ def crawl(config, engine, _args):
             config.smtp_port,
             config.smtp_user,
             config.smtp_password,
-        )
+            config.smtp_ssl,
+        ),
+        connections=args.smtp_connections,
     )
-    for subscription, apartment_dict in notifications.items():
-        apartment_list = format_mail(apartment_dict)
-
-        log.info(
-            "found %(number)s new apartments to send to %(email)s",
-            {"number": len(apartment_list), "email": subscription.email},
+    for message in messages:
+        mail_server.register_message(
+            subject=message.subject,
+            receiver=message.receiver,
+            content=message.content,
+            html=message.html,
         )
-        if len(apartment_list) > 0:
-            mail_content = "\n".join(apartment_list)
-            mail_server.register_message(
-                subject="New SGS apartments",
-                receiver=subscription.email,
-                content=mail_content,
+
+    # a message is only marked as sent once the server accepted it, so a crash
+    # in between delivers it again on the next run
+    results = mail_server.send_all(attempts=3)
+    finished = datetime.now()
+    backoff = timedelta(minutes=args.delivery_backoff)
+    rows = []
+    for message, result in zip(messages, results):
+        attempts = message.attempts + 1
+        if not result.sent and attempts >= args.max_delivery_attempts:
+            log.error(
+                "Message %(id)s to %(receiver)s failed %(attempts)s times, "
+                "retrying later: %(error)s",
+                {
+                    "id": message.id,
+                    "receiver": message.receiver,
+                    "attempts": attempts,
+                    "error": result.error,
+                },
             )
-            log.info("Update database...")
-            with Session(engine) as session:
-                store_sent_apartments(session, apartment_dict, subscription, True)
+        rows.append(
+            {
+                "id": message.id,
+                "attempts": attempts,
+                "sent": finished if result.sent else None,
+                "next_attempt": (
+                    None
+                    if result.sent
+                    else finished + get_delivery_delay(attempts, backoff)
+                ),
+                "last_error": result.error,
+            }
+        )
+    with Session(engine) as session:
+        session.execute(update(OutboxMessage), rows)
+        session.commit()
 
-    try:
-        mail_server.send_all(attempts=3)
-    except MailSendException:
-        with Session(engine) as session:
-            store_sent_apartments(session, apartment_dict, subscription, False)
+    return results
+
+
+def get_place_id(session: Session, name):
+    statement = (
+        insert(Place)
+        .values({"key": get_place_key(name), "name": name})
+        .on_conflict_do_update(
+            index_elements=[Place.key], set_={"key": get_place_key(name)}
+        )
+        .returning(Place.id)
+    )
+    return session.execute(statement).scalar_one()
 
 
 def add_subscription(_config, engine, args):
@@ -289,6 +983,11 @@ def add_subscription(_config, engine, args):
                     "email": args.email,
                     "max_rent": args.max_rent,
                     "min_area": args.min_area,
+                    "locations": args.locations,
+                    "sizes": args.sizes,
+                    "free_from_after": args.free_from_after,
+                    "free_from_before": args.free_from_before,
+                    "max_commute": args.max_commute,
                 }
             )
             .returning(Subscription.id)
@@ -298,7 +997,11 @@ def add_subscription(_config, engine, args):
 
         if args.destinations is not None:
             destinations = [
-                {"subscription_id": subscription_id, "destination": destination}
+                {
+                    "subscription_id": subscription_id,
+                    "destination": destination,
+                    "place_id": get_place_id(session, destination),
+                }
                 for destination in args.destinations
             ]
 
@@ -315,6 +1018,90 @@ def remove_subscription(_config, engine, args):
         session.commit()
 
 
+def get_database_size(database_path):
+    return sum(
+        os.path.getsize(path)
+        for path in (database_path, f"{database_path}-wal")
+        if os.path.exists(path)
+    )
+
+
+def maintenance(config, engine, args):
+    database_path = get_database_path(config.data_root)
+    size_before = get_database_size(database_path)
+
+    cutoff = datetime.now() - timedelta(days=args.retention_days)
+    with Session(engine) as session:
+        statement = delete(Apartment).where(
+            func.coalesce(Apartment.last_seen, Apartment.updated) < cutoff
+        )
+        deleted = session.execute(statement).rowcount
+        session.commit()
+    log.info("deleted %s apartments not listed since %s", deleted, cutoff)
+
+    with Session(engine) as session:
+        # unsent messages stay until they are delivered
+        statement = delete(OutboxMessage).where(OutboxMessage.sent < cutoff)
+        deleted = session.execute(statement).rowcount
+        session.commit()
+    log.info("deleted %s messages sent before %s from the outbox", deleted, cutoff)
+
+    get_vasttrafik_cache(config, engine).evict()
+
+    log.info("compacting database...")
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.exec_driver_sql("VACUUM")
+        connection.exec_driver_sql("ANALYZE")
+        # in WAL mode VACUUM writes the compacted pages into the log, so they are
+        # moved into the database and the log is truncated before measuring
+        connection.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    size_after = get_database_size(database_path)
+    log.info(
+        "reclaimed %(reclaimed)s bytes, database size is now %(size)s bytes",
+        {"reclaimed": size_before - size_after, "size": size_after},
+    )
+
+
+def serve(config, engine, args):
+    jitter = timedelta(seconds=args.jitter)
+    if args.cron is not None:
+        schedule = CronSchedule(args.cron, jitter)
+    else:
+        schedule = IntervalSchedule(timedelta(minutes=args.interval), jitter)
+
+    stop = threading.Event()
+
+    def request_stop(signal_number, _frame):
+        log.info("received %s, shutting down...", signal.Signals(signal_number).name)
+        stop.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    run_scheduled(schedule, lambda: crawl(config, engine, args), stop)
+    engine.dispose()
+
+
+def explain(_config, engine, _args):
+    statements = {
+        "get_filtered_apartments": filtered_apartments_statement(datetime.now()),
+        "get_new_apartments": new_apartments_statement(),
+    }
+    with engine.connect() as connection:
+        for name, statement in statements.items():
+            query = statement.compile(
+                dialect=engine.dialect, compile_kwargs={"literal_binds": True}
+            )
+            plan = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {query}").all()
+
+            depths = {0: -1}
+            print(f"{name}:")
+            for node_id, parent_id, _, detail in plan:
+                depths[node_id] = depths.get(parent_id, -1) + 1
+                print(f"{'  ' * (depths[node_id] + 1)}{detail}")
+
+
 @event.listens_for(Engine, "connect")
 def set_sqlite_pragma(dbapi_connection, _connection_record):
     cursor = dbapi_connection.cursor()
@@ -322,7 +1109,7 @@ def set_sqlite_pragma(dbapi_connection, _connection_record):
     cursor.close()
 
 
-if __name__ == "__main__":
+def get_argument_parser():
     parser = argparse.ArgumentParser()
     subparsers = parser.add_subparsers(required=True)
     subscription_parser = subparsers.add_parser("subscription")
@@ -332,19 +1119,69 @@ if __name__ == "__main__":
     add_subscription_parser.add_argument("--max_rent", type=int, default=100000)
     add_subscription_parser.add_argument("--min_area", type=int, default=0)
     add_subscription_parser.add_argument("--destinations", nargs="*")
+    add_subscription_parser.add_argument("--locations", nargs="*")
+    add_subscription_parser.add_argument("--sizes", nargs="*")
+    add_subscription_parser.add_argument(
+        "--free_from_after", type=datetime.fromisoformat
+    )
+    add_subscription_parser.add_argument(
+        "--free_from_before", type=datetime.fromisoformat
+    )
+    add_subscription_parser.add_argument("--max_commute", type=int)
     add_subscription_parser.set_defaults(func=add_subscription)
 
     add_subscription_parser = subscription_sub_parser.add_parser("remove")
     add_subscription_parser.add_argument("--email", type=str, required=True)
     add_subscription_parser.set_defaults(func=remove_subscription)
 
-    crawl_apartments = subparsers.add_parser("crawl")
+    crawl_arguments = argparse.ArgumentParser(add_help=False)
+    crawl_arguments.add_argument("--workers", type=int, default=4)
+    crawl_arguments.add_argument("--chunk_size", type=int, default=100)
+    crawl_arguments.add_argument(
+        "--matcher", choices=["memory", "sql"], default="memory"
+    )
+    crawl_arguments.add_argument("--browsers", type=int, default=1)
+    crawl_arguments.add_argument("--max_browser_pages", type=int, default=50)
+    crawl_arguments.add_argument("--max_browser_memory", type=int, default=1024)
+    crawl_arguments.add_argument("--prometheus_file", type=str)
+
+    delivery_arguments = argparse.ArgumentParser(add_help=False)
+    delivery_arguments.add_argument("--smtp_connections", type=int, default=3)
+    delivery_arguments.add_argument("--max_delivery_attempts", type=int, default=5)
+    delivery_arguments.add_argument("--delivery_backoff", type=float, default=5)
+
+    crawl_apartments = subparsers.add_parser(
+        "crawl", parents=[crawl_arguments, delivery_arguments]
+    )
     crawl_apartments.set_defaults(func=crawl)
 
-    args = parser.parse_args()
+    serve_parser = subparsers.add_parser(
+        "serve", parents=[crawl_arguments, delivery_arguments]
+    )
+    schedule_group = serve_parser.add_mutually_exclusive_group()
+    schedule_group.add_argument("--interval", type=float, default=10)
+    schedule_group.add_argument("--cron", type=str)
+    serve_parser.add_argument("--jitter", type=float, default=60)
+    serve_parser.set_defaults(func=serve)
+
+    deliver_parser = subparsers.add_parser("deliver", parents=[delivery_arguments])
+    deliver_parser.set_defaults(func=deliver)
+
+    maintenance_parser = subparsers.add_parser("maintenance")
+    maintenance_parser.add_argument("--retention_days", type=int, default=30)
+    maintenance_parser.set_defaults(func=maintenance)
+
+    explain_parser = subparsers.add_parser("explain")
+    explain_parser.set_defaults(func=explain)
+
+    return parser
+
+
+if __name__ == "__main__":
+    args = get_argument_parser().parse_args()
 
     config = load_config()
     os.makedirs(config.data_root, exist_ok=True)
-    engine = get_db_engine(config.data_root)
+    engine = get_db_engine(config)
 
     args.func(config, engine, args)
@@ -1,61 +1,211 @@
 import logging
+from collections.abc import Iterator
+from dataclasses import dataclass
 from datetime import datetime
+from html.parser import HTMLParser
 
-from selenium.webdriver.common.by import By
-from selenium.webdriver.firefox.webdriver import WebDriver
-from selenium.webdriver.remote.webelement import WebElement
 from selenium.webdriver.support import expected_conditions
 from selenium.webdriver.support.wait import WebDriverWait
 
+from webdriver import WebDriverPool
+
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
+APARTMENT_URL = "https://minasidor.sgs.se/market/residential/{}"
+
+CARD_FIELDS = ("address", "location", "size", "area", "rent", "free-from")
+# elements that start a new line in the text of a card
+BLOCK_TAGS = {
+    "br",
+    "dd",
+    "div",
+    "dl",
+    "dt",
+    "h1",
+    "h2",
+    "h3",
+    "h4",
+    "h5",
+    "h6",
+    "li",
+    "ol",
+    "p",
+    "section",
+    "tr",
+    "ul",
+}
+VOID_TAGS = {
+    "area",
+    "base",
+    "br",
+    "col",
+    "embed",
+    "hr",
+    "img",
+    "input",
+    "link",
+    "meta",
+    "source",
+    "track",
+    "wbr",
+}
 
+
+@dataclass
 class SGSApartment:
-    def __init__(self, apartment_element: WebElement) -> None:
-        self.id = apartment_element.find_element(By.TAG_NAME, "mat-card").get_property(
-            "id"
-        )
-        self.address = apartment_element.find_element(By.CLASS_NAME, "address").text
-        self.location = apartment_element.find_element(By.CLASS_NAME, "location").text
-        self.size = apartment_element.find_element(By.CLASS_NAME, "size").text.split(
-            "\n"
-        )[0]
-        self.area = float(
-            apartment_element.find_element(By.CLASS_NAME, "area").text.split("\n")[0]
-        )
-        self.rent = int(
-            apartment_element.find_element(By.CLASS_NAME, "rent").text.split("\n")[0]
-        )
-        self.free_from = datetime.strptime(
-            apartment_element.find_element(By.CLASS_NAME, "free-from").text.split("\n")[
-                0
-            ],
-            "%Y-%m-%d",
+    id: str
+    address: str
+    location: str
+    size: str
+    area: float
+    rent: int
+    free_from: datetime
+    url: str
+
+    @classmethod
+    def from_card(cls, card: dict) -> "SGSApartment":
+        def first_line(field):
+            return card[field].split("\n")[0]
+
+        return cls(
+            id=card["id"],
+            address=card["address"],
+            location=card["location"],
+            size=first_line("size"),
+            area=float(first_line("area")),
+            rent=int(first_line("rent")),
+            free_from=datetime.strptime(first_line("free-from"), "%Y-%m-%d"),
+            url=APARTMENT_URL.format(card["id"]),
         )
-        self.url = f"https://minasidor.sgs.se/market/residential/{self.id}"
 
 
 class SGS:
-    URL = "https://minasidor.sgs.se/market/residential?pageSize=100"
+    URL = "https://minasidor.sgs.se/market/residential?pageSize={page_size}&page={page}"
+
+    def __init__(self, webdriver_pool: WebDriverPool, url=URL) -> None:
+        self.webdriver_pool = webdriver_pool
+        self.url = url
+
+    def _get_page(self, page, page_size) -> list[SGSApartment]:
+        with self.webdriver_pool.driver() as driver:
+            driver.get(self.url.format(page_size=page_size, page=page))
+
+            wait = WebDriverWait(driver, 15)
+            wait.until(expected_conditions.title_is("Mina Sidor"))
+
+            log.info("Opened page %s", page)
+
+            # the page source holds every card, so it is read in one round trip
+            page_source = driver.page_source
 
-    def __init__(self, driver: WebDriver) -> None:
-        self.driver = driver
+        return [SGSApartment.from_card(card) for card in parse_cards(page_source)]
 
-    def get_apartments(self) -> list[SGSApartment]:
-        self.driver.get(self.URL)
+    def iter_apartments(self, page_size=100) -> Iterator[SGSApartment]:
+        yield from _paginate(self._get_page, page_size)
 
-        wait = WebDriverWait(self.driver, 15)
-        wait.until(expected_conditions.title_is("Mina Sidor"))
 
-        log.info("Opened website")
+def parse_cards(page_source) -> list[dict]:
+    parser = _CardParser()
+    parser.feed(page_source)
+    parser.close()
+    return parser.cards
 
+
+class _CardParser(HTMLParser):
+    # reads every "taiga-market-objects-list > div" card, with the text of the
+    # first element of each field class broken into lines like innerText
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.cards: list[dict] = []
+        self._depth = 0
+        self._list_depth = None
+        self._card_depth = None
+        self._field = None
+        self._field_depth = None
+        self._lines: list[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in BLOCK_TAGS:
+            self._break_line()
+        if tag in VOID_TAGS:
+            return
+        self._depth += 1
+
+        attributes = dict(attrs)
+        if tag == "taiga-market-objects-list" and self._list_depth is None:
+            self._list_depth = self._depth
+        elif (
+            tag == "div"
+            and self._list_depth is not None
+            and self._depth == self._list_depth + 1
+        ):
+            self._card_depth = self._depth
+            self.cards.append({})
+        elif self._card_depth is not None and self._field is None:
+            card = self.cards[-1]
+            if tag == "mat-card" and "id" not in card:
+                card["id"] = attributes.get("id")
+            classes = (attributes.get("class") or "").split()
+            for field in CARD_FIELDS:
+                if field in classes and field not in card:
+                    self._field = field
+                    self._field_depth = self._depth
+                    self._lines = [""]
+                    break
+
+    def handle_endtag(self, tag):
+        if tag in VOID_TAGS:
+            return
+        if tag in BLOCK_TAGS:
+            self._break_line()
+
+        if self._depth == self._field_depth:
+            lines = (" ".join(line.split()) for line in self._lines)
+            self.cards[-1][self._field] = "\n".join(line for line in lines if line)
+            self._field = None
+            self._field_depth = None
+        if self._depth == self._card_depth:
+            self._card_depth = None
+        if self._depth == self._list_depth:
+            self._list_depth = None
+        self._depth -= 1
+
+    def handle_data(self, data):
+        if self._field is not None:
+            self._lines[-1] += data
+
+    def _break_line(self):
+        if self._field is not None:
+            self._lines.append("")
+
+
+def _paginate(get_page, page_size) -> Iterator[SGSApartment]:
+    seen_ids = set()
+    full_page = page_size
+    page = 1
+    while True:
+        page_apartments = get_page(page, page_size)
         apartments = [
-            SGSApartment(apartment)
-            for apartment in self.driver.find_elements(
-                By.CSS_SELECTOR, "taiga-market-objects-list > div"
-            )
+            apartment for apartment in page_apartments if apartment.id not in seen_ids
         ]
-        log.info("Found %s apartments.", len(apartments))
+        seen_ids.update(apartment.id for apartment in apartments)
+        yield from apartments
+
+        # a market capping the page size returns fewer apartments than asked for,
+        # so the first page sets how many a full page holds
+        if page == 1:
+            full_page = len(page_apartments)
+        # listings moving between requests only shift the pages, so only a short
+        # page ends the walk. A full page without unseen apartments means the
+        # market ignored the page parameter.
+        if len(page_apartments) == 0 or len(page_apartments) < full_page:
+            break
+        if len(apartments) == 0:
+            log.warning(
+                "The market ignores the page parameter, stopping at page %s.", page
+            )
+            break
+        page += 1
 
-        return apartments
+    log.info("Found %s apartments.", len(seen_ids))
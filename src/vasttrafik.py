@@ -1,11 +1,20 @@
+import heapq
+import itertools
 import json
 import logging
 import os
+import tempfile
+import threading
+import time
+from collections import Counter
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 
 import jwt
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
@@ -23,9 +32,9 @@ class JourneyNotFoundException(Exception):
 class Location:
     name: str
     location_type: str
-    latitude: str
-    longitude: str
-    has_local_service: str
+    latitude: float
+    longitude: float
+    has_local_service: bool
 
     def __hash__(self) -> int:
         return hash((self.latitude, self.longitude))
@@ -37,78 +46,297 @@ class Location:
         return self.latitude == value.latitude and self.longitude == value.longitude
 
 
+PRIORITY_NEW = 0
+PRIORITY_REFRESH = 1
+
+
+class RateLimiter:
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._waiting: list[tuple[int, int]] = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def acquire(self, priority=PRIORITY_REFRESH) -> bool:
+        with self._condition:
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(self._waiting, ticket)
+
+            throttled = False
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+
+                # waiters are served strictly in priority order
+                if self._waiting[0] == ticket:
+                    if now >= self._paused_until and self._tokens >= 1:
+                        heapq.heappop(self._waiting)
+                        self._tokens -= 1
+                        self._condition.notify_all()
+                        return throttled
+                    timeout = max(
+                        self._paused_until - now, (1 - self._tokens) / self.rate
+                    )
+                else:
+                    timeout = None
+
+                throttled = True
+                self._condition.wait(timeout)
+
+    def pause(self, seconds: float):
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._condition.notify_all()
+
+
+def _retry_after_seconds(response: requests.Response, default: float) -> float:
+    retry_after = response.headers.get("Retry-After")
+    if retry_after is None:
+        return default
+
+    try:
+        return max(float(retry_after), 0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return default
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0)
+
+
+class TokenProvider:
+    URL = "https://ext-api.vasttrafik.se/token"
+    # refresh ahead of the expiry, so that a token never expires mid request
+    REFRESH_MARGIN = timedelta(minutes=10)
+
+    def __init__(self, authentication_key, token_file, request, url=URL) -> None:
+        self.authentication_key = authentication_key
+        self.token_file = token_file
+        self.request = request
+        self.url = url
+
+        self._lock = threading.Lock()
+        self._token = None
+        self._expires_at: datetime | None = None
+        self._loaded = False
+
+    def get(self) -> str:
+        with self._lock:
+            if not self._loaded:
+                self._loaded = True
+                self._load()
+            if self._expires_soon():
+                self._refresh()
+            return self._token
+
+    def invalidate(self, token):
+        with self._lock:
+            # another thread may already have replaced the rejected token
+            if token == self._token:
+                self._expires_at = None
+
+    def _expires_soon(self) -> bool:
+        return (
+            self._expires_at is None
+            or self._expires_at - self.REFRESH_MARGIN < datetime.now(timezone.utc)
+        )
+
+    def _load(self):
+        try:
+            with open(self.token_file, "r", encoding="utf-8") as f:
+                self._set(json.load(f))
+        except (OSError, ValueError, KeyError, jwt.PyJWTError):
+            log.info("no usable access token in %s", self.token_file)
+
+    def _refresh(self):
+        headers = {
+            "Content-Type": "application/x-www-form-urlencoded",
+            "Authorization": f"Basic {self.authentication_key}",
+        }
+        data = "grant_type=client_credentials&scope=device_sgs"
+        token = self.request(
+            "POST", self.url, PRIORITY_NEW, data=data, headers=headers
+        ).json()
+        self._set(token)
+        self._store(token)
+        log.info("refreshed access token, valid until %s", self._expires_at)
+
+    def _set(self, token: dict):
+        try:
+            expires_at = jwt.decode(
+                token["access_token"], options={"verify_signature": False}
+            )["exp"]
+        except (jwt.PyJWTError, KeyError):
+            expires_at = time.time() + token["expires_in"]
+
+        self._token = token["access_token"]
+        self._expires_at = datetime.fromtimestamp(expires_at, timezone.utc)
+
+    def _store(self, token: dict):
+        # write next to the target and swap it in, so that a crash never
+        # leaves a truncated token file behind
+        directory = os.path.dirname(self.token_file) or "."
+        with tempfile.NamedTemporaryFile(
+            "w", encoding="utf-8", dir=directory, delete=False
+        ) as f:
+            json.dump(token, f)
+        os.replace(f.name, self.token_file)
+
+
 class VasttrafikAPI:
     ACCESS_TOKEN_FILE = "access_token.json"
     BASE_URL = "https://ext-api.vasttrafik.se/pr/v4"
-
-    def __init__(self, authentication_key, data_root) -> None:
+    # 429 is handled by the rate limiter, so that it pauses every worker
+    RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+    def __init__(
+        self,
+        authentication_key,
+        data_root,
+        cache=None,
+        pool_size=10,
+        retries=3,
+        backoff_factor=0.5,
+        adapter: HTTPAdapter | None = None,
+        rate_limiter: RateLimiter | None = None,
+        base_url=BASE_URL,
+        token_url=TokenProvider.URL,
+    ) -> None:
+        self.authentication_key = authentication_key
+        self.base_url = base_url
         self.data_root = data_root
-        if not self._has_valid_token():
-            self._generate_token(authentication_key)
+        self.cache = cache
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.rate_limiter = (
+            rate_limiter if rate_limiter is not None else RateLimiter(10, 10)
+        )
+        self.counters = Counter()
+        self.latencies: list[float] = []
+        self.resolved_searches: set[str] = set()
+        self._counters_lock = threading.Lock()
+
+        if adapter is None:
+            adapter = HTTPAdapter(
+                pool_maxsize=pool_size,
+                max_retries=Retry(
+                    total=retries,
+                    backoff_factor=backoff_factor,
+                    status_forcelist=self.RETRY_STATUS_CODES,
+                    allowed_methods=None,
+                    respect_retry_after_header=False,
+                ),
+            )
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
 
-        with open(
-            os.path.join(self.data_root, self.ACCESS_TOKEN_FILE), "r", encoding="utf-8"
-        ) as f:
-            self.token = json.load(f)["access_token"]
+        self.token_provider = TokenProvider(
+            authentication_key,
+            os.path.join(data_root, self.ACCESS_TOKEN_FILE),
+            lambda *args, **kwargs: self._request(*args, authenticated=False, **kwargs),
+            url=token_url,
+        )
 
         self.location_cache: dict[str:Location] = {}
         self.duration_cache: dict[(Location, Location):timedelta] = {}
 
-    def _has_valid_token(self):
-        valid = True
-        if not os.path.exists(os.path.join(self.data_root, self.ACCESS_TOKEN_FILE)):
-            valid = False
-
-        else:
-            with open(
-                os.path.join(self.data_root, self.ACCESS_TOKEN_FILE),
-                "r",
-                encoding="utf-8",
-            ) as f:
-                token = json.load(f)
-            decoded_token = jwt.decode(
-                token["access_token"],
-                options={"verify_signature": False},
+    def _count(self, counter):
+        with self._counters_lock:
+            self.counters[counter] += 1
+
+    def _count_resolved(self, search):
+        with self._counters_lock:
+            if search not in self.resolved_searches:
+                self.resolved_searches.add(search)
+                self.counters["locations_resolved"] += 1
+
+    def clear_memory_cache(self):
+        # the persisted cache applies the TTL and size limit, so a long-running
+        # process only keeps the lookups of one crawl in memory
+        self.location_cache.clear()
+        self.duration_cache.clear()
+
+    def drain_metrics(self) -> tuple[Counter, list[float]]:
+        with self._counters_lock:
+            counters, self.counters = self.counters, Counter()
+            latencies, self.latencies = self.latencies, []
+            self.resolved_searches = set()
+        return counters, latencies
+
+    def _request(
+        self, method, url, priority=PRIORITY_REFRESH, authenticated=True, **kwargs
+    ):
+        headers = kwargs.pop("headers", {})
+        token = None
+        for attempt in range(self.retries + 1):
+            if authenticated:
+                token = self.token_provider.get()
+                headers["Authorization"] = f"Bearer {token}"
+
+            if self.rate_limiter.acquire(priority):
+                self._count("throttled")
+            self._count("requests")
+            start = time.perf_counter()
+            response = self.session.request(
+                method, url, timeout=10, headers=headers, **kwargs
             )
-            expire_time = datetime.fromtimestamp(decoded_token["exp"])
-
-            if expire_time < (datetime.now() + timedelta(minutes=10)):
-                valid = False
-
-        return valid
+            with self._counters_lock:
+                self.latencies.append(time.perf_counter() - start)
+
+            if response.status_code == 401 and authenticated and attempt == 0:
+                log.info("access token was rejected, refreshing it")
+                self.token_provider.invalidate(token)
+                continue
+            if response.status_code != 429:
+                break
+
+            retry_after = _retry_after_seconds(
+                response, self.backoff_factor * 2**attempt
+            )
+            log.warning("rate limited by Västtrafik, pausing for %ss", retry_after)
+            self.rate_limiter.pause(retry_after)
 
-    def _generate_token(self, authentication_key):
-        token_url = "https://ext-api.vasttrafik.se/token"
-        headers = {
-            "Content-Type": "application/x-www-form-urlencoded",
-            "Authorization": f"Basic {authentication_key}",
-        }
-        data = "grant_type=client_credentials&scope=device_sgs"
+        response.raise_for_status()
+        return response
 
-        with open(
-            os.path.join(self.data_root, self.ACCESS_TOKEN_FILE), "w", encoding="utf-8"
-        ) as f:
-            token = requests.post(
-                token_url, data=data, headers=headers, timeout=10
-            ).json()
-            json.dump(token, f)
+    def get_location(self, search, priority=PRIORITY_REFRESH) -> Location:
+        return self._get_location(search, priority, count_hits=True)
 
-    def get_location(self, search) -> Location:
+    def _get_location(self, search, priority, count_hits) -> Location:
         if search in self.location_cache:
+            if count_hits:
+                self._count("location_cache_hits")
             location = self.location_cache[search]
             log.debug(
                 "using cached location for %s",
                 search,
             )
+        elif (
+            self.cache is not None
+            and (location := self.cache.get_location(search)) is not None
+        ):
+            if count_hits:
+                self._count("location_cache_hits")
+            self.location_cache[search] = location
+            log.debug(
+                "using persisted location for %s",
+                search,
+            )
         else:
-            url = f"{self.BASE_URL}/locations/by-text"
-            headers = {
-                "Authorization": f"Bearer {self.token}",
-            }
+            self._count("location_cache_misses")
+            url = f"{self.base_url}/locations/by-text"
             data = {"q": search, "limit": 1}
-            response = requests.get(
-                url, params=data, headers=headers, timeout=10
-            ).json()
+            response = self._request("GET", url, priority, params=data).json()
 
             if len(response["results"]) == 0:
                 raise LocationNotFoundException
@@ -123,25 +351,45 @@ class VasttrafikAPI:
                 has_local_service=result["hasLocalService"],
             )
             self.location_cache[search] = location
+            if self.cache is not None:
+                self.cache.store_location(search, location)
 
+        self._count_resolved(search)
         return location
 
-    def get_planned_duration(self, origin, destination):
-        origin_location = self.get_location(origin)
-        destination_location = self.get_location(destination)
+    def get_planned_duration(self, origin, destination, priority=PRIORITY_REFRESH):
+        # the ends of a journey are looked up again for every journey, which
+        # would count as location cache hits, so only their misses are counted
+        origin_location = self._get_location(origin, priority, count_hits=False)
+        destination_location = self._get_location(
+            destination, priority, count_hits=False
+        )
 
         if (origin_location, destination_location) in self.duration_cache:
+            self._count("journey_cache_hits")
             duration = self.duration_cache[(origin_location, destination_location)]
             log.debug(
                 "using cached duration from %(origin)s to %(destination)s",
                 {"origin": origin, "destination": destination},
             )
+        elif (
+            self.cache is not None
+            and (
+                duration := self.cache.get_duration(
+                    origin_location, destination_location
+                )
+            )
+            is not None
+        ):
+            self._count("journey_cache_hits")
+            self.duration_cache[(origin_location, destination_location)] = duration
+            log.debug(
+                "using persisted duration from %(origin)s to %(destination)s",
+                {"origin": origin, "destination": destination},
+            )
         else:
-
-            url = f"{self.BASE_URL}/journeys"
-            headers = {
-                "Authorization": f"Bearer {self.token}",
-            }
+            self._count("journey_cache_misses")
+            url = f"{self.base_url}/journeys"
 
             tomorrow = datetime.now() + timedelta(days=1)
             date = datetime(
@@ -164,9 +412,7 @@ class VasttrafikAPI:
                 "dateTimeRelatesTo": "departure",
                 "limit": 1,
             }
-            response = requests.get(
-                url, params=data, headers=headers, timeout=10
-            ).json()
+            response = self._request("GET", url, priority, params=data).json()
 
             if len(response["results"]) == 0:
                 raise JourneyNotFoundException
@@ -200,5 +446,9 @@ class VasttrafikAPI:
 
             duration = end_time - start_time
             self.duration_cache[(origin_location, destination_location)] = duration
+            if self.cache is not None:
+                self.cache.store_duration(
+                    origin_location, destination_location, duration
+                )
 
         return duration
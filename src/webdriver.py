@@ -1,5 +1,16 @@
+import atexit
+import logging
+import queue
+import threading
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
+
+from selenium.common.exceptions import WebDriverException
 from selenium.webdriver import Firefox, FirefoxOptions
 
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
 
 def get_webdriver(headless=True) -> Firefox:
     options = FirefoxOptions()
@@ -10,3 +21,108 @@ def get_webdriver(headless=True) -> Firefox:
     driver = Firefox(options=options)
 
     return driver
+
+
+@dataclass
+class PooledWebDriver:
+    driver: Firefox
+    pages: int = 0
+
+
+class WebDriverPool:
+    def __init__(
+        self,
+        size=1,
+        max_pages=50,
+        max_memory_mb=1024,
+        headless=True,
+        launch_stage=nullcontext,
+    ) -> None:
+        self.max_pages = max_pages
+        self.max_memory_mb = max_memory_mb
+        self.headless = headless
+        self.launch_stage = launch_stage
+
+        self._idle: queue.LifoQueue[PooledWebDriver] = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        atexit.register(self.close)
+
+    @contextmanager
+    def driver(self):
+        with self._slots:
+            pooled = self._acquire()
+            try:
+                yield pooled.driver
+            except Exception:
+                _quit(pooled)
+                raise
+
+            pooled.pages += 1
+            if self._needs_recycling(pooled):
+                _quit(pooled)
+            else:
+                self._idle.put(pooled)
+
+    def close(self):
+        while True:
+            try:
+                _quit(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+    def _acquire(self) -> PooledWebDriver:
+        try:
+            pooled = self._idle.get_nowait()
+        except queue.Empty:
+            log.info("starting browser...")
+            return self._launch()
+
+        if _is_healthy(pooled):
+            return pooled
+
+        log.warning("browser stopped responding, restarting it...")
+        _quit(pooled)
+        return self._launch()
+
+    def _launch(self) -> PooledWebDriver:
+        with self.launch_stage():
+            return PooledWebDriver(get_webdriver(headless=self.headless))
+
+    def _needs_recycling(self, pooled: PooledWebDriver) -> bool:
+        if pooled.pages >= self.max_pages:
+            log.info("recycling browser after %s pages", pooled.pages)
+            return True
+
+        memory_mb = _memory_usage_mb(pooled.driver)
+        if memory_mb is not None and memory_mb > self.max_memory_mb:
+            log.info("recycling browser using %s MB", memory_mb)
+            return True
+
+        return False
+
+
+def _is_healthy(pooled: PooledWebDriver) -> bool:
+    try:
+        pooled.driver.current_url
+    except WebDriverException:
+        return False
+    return True
+
+
+def _memory_usage_mb(driver: Firefox) -> int | None:
+    process_id = driver.capabilities.get("moz:processID")
+    try:
+        with open(f"/proc/{process_id}/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return None
+
+
+def _quit(pooled: PooledWebDriver):
+    try:
+        pooled.driver.quit()
+    except WebDriverException:
+        log.warning("Failed to quit the browser.", exc_info=True)
@@ -0,0 +1,38 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+sys.path.insert(0, SRC)
+
+
+@pytest.fixture(scope="session")
+def bot():
+    # the bot is a script with a dash in its name, so it cannot be imported directly
+    spec = importlib.util.spec_from_file_location(
+        "sgs_bot", os.path.join(SRC, "sgs-bot.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def config(bot, tmp_path):
+    return bot.Config(
+        data_root=str(tmp_path),
+        vasttrafik_api_key="",
+        smpt_server="",
+        smtp_port="",
+        smtp_user="",
+        smtp_password="",
+    )
+
+
+@pytest.fixture
+def engine(bot, config):
+    engine = bot.get_db_engine(config)
+    yield engine
+    engine.dispose()
@@ -0,0 +1,31 @@
+import pytest
+
+
+class FakeWebDriverPool:
+    instances = []
+
+    def __init__(self, size=1, max_pages=50, max_memory_mb=1024) -> None:
+        self.launch_stage = None
+        self.instances.append(self)
+
+
+@pytest.fixture
+def webdriver_pool(bot, monkeypatch):
+    monkeypatch.setattr(bot, "WebDriverPool", FakeWebDriverPool)
+    monkeypatch.setattr(FakeWebDriverPool, "instances", [])
+    monkeypatch.setattr(bot, "scrape_apartments", lambda *args: iter([]))
+    bot.get_webdriver_pool.cache_clear()
+    yield FakeWebDriverPool
+    bot.get_webdriver_pool.cache_clear()
+
+
+def test_crawls_share_one_browser_pool(bot, config, engine, webdriver_pool):
+    args = bot.get_argument_parser().parse_args(["crawl"])
+
+    bot.crawl(config, engine, args)
+    first_launch_stage = webdriver_pool.instances[0].launch_stage
+    bot.crawl(config, engine, args)
+
+    assert len(webdriver_pool.instances) == 1
+    # every crawl times the launches in its own metrics
+    assert webdriver_pool.instances[0].launch_stage is not first_launch_stage
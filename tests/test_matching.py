@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.orm import Session
+
+from database import Apartment, SubscribedApartments, Subscription
+
+SEEN = datetime(2026, 10, 1, 6)
+
+
+def apartment(apartment_id, area, rent, updated=SEEN, last_seen=SEEN):
+    return Apartment(
+        id=apartment_id,
+        address=f"Address {apartment_id}",
+        location="Olofshöjd",
+        size="1 rok",
+        area=area,
+        rent=rent,
+        free_from=datetime(2026, 11, 1),
+        url=f"https://example.com/{apartment_id}",
+        updated=updated,
+        first_seen=SEEN,
+        last_seen=last_seen,
+    )
+
+
+@pytest.fixture
+def session(engine):
+    with Session(engine) as session:
+        session.add_all(
+            [
+                # exactly on the boundaries of subscription 1
+                apartment("area-boundary", area=20, rent=4000),
+                apartment("rent-boundary", area=30, rent=5000),
+                apartment("inside", area=20.5, rent=4999),
+                apartment("large", area=60, rent=4500),
+                apartment(
+                    "unlisted", area=60, rent=4500, last_seen=SEEN - timedelta(days=1)
+                ),
+                # updated before and after subscription 3 was last matched
+                apartment(
+                    "unchanged", area=40, rent=4000, updated=SEEN - timedelta(days=2)
+                ),
+                apartment("changed", area=40, rent=4000),
+                Subscription(id=1, email="one@example.com", min_area=20, max_rent=5000),
+                Subscription(id=2, email="two@example.com", min_area=50, max_rent=6000),
+                Subscription(
+                    id=3,
+                    email="three@example.com",
+                    min_area=30,
+                    max_rent=4500,
+                    last_matched=SEEN - timedelta(days=1),
+                ),
+            ]
+        )
+        session.flush()
+        session.add_all(
+            [
+                SubscribedApartments(
+                    apartment_id="large", subscription_id=1, notified=True
+                ),
+                SubscribedApartments(
+                    apartment_id="inside", subscription_id=1, notified=False
+                ),
+            ]
+        )
+        session.commit()
+        yield session
+
+
+def test_memory_matcher_matches_the_query(bot, session):
+    memory = bot.get_matches(session, SEEN, "memory")
+    sql = bot.get_matches(session, SEEN, "sql")
+
+    assert len(memory) == len(set(memory))
+    assert set(memory) == set(sql)
+    assert set(memory) == {
+        ("inside", 1),
+        ("unchanged", 1),
+        ("changed", 1),
+        ("large", 2),
+        ("changed", 3),
+    }
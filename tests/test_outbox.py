@@ -0,0 +1,105 @@
+import logging
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from database import OutboxMessage
+from mail import DeliveryResult
+
+
+class FakeMailServer:
+    accepts = False
+
+    def __init__(self, smtp_server_config, connections=3) -> None:
+        self.registered_messages = []
+
+    def register_message(self, subject, receiver, content, html=None):
+        self.registered_messages.append(receiver)
+
+    def send_all(self, attempts=1, backoff=1.0):
+        return [
+            DeliveryResult(
+                receiver,
+                sent=self.accepts,
+                attempts=attempts,
+                error=None if self.accepts else "SMTPServerDisconnected()",
+            )
+            for receiver in self.registered_messages
+        ]
+
+
+@pytest.fixture
+def mail_server(bot, monkeypatch):
+    monkeypatch.setattr(bot, "MailServer", FakeMailServer)
+    monkeypatch.setattr(FakeMailServer, "accepts", False)
+    return FakeMailServer
+
+
+@pytest.fixture
+def args(bot):
+    return bot.get_argument_parser().parse_args(
+        ["deliver", "--max_delivery_attempts", "2", "--delivery_backoff", "10"]
+    )
+
+
+def get_message(engine):
+    with Session(engine) as session:
+        return session.execute(select(OutboxMessage)).scalar_one()
+
+
+def test_failed_messages_are_retried_after_a_growing_delay(
+    bot, config, engine, mail_server, args
+):
+    with Session(engine) as session:
+        session.add(OutboxMessage(receiver="a@example.com", subject="s", content="c"))
+        session.commit()
+
+    assert len(bot.deliver(config, engine, args)) == 1
+    first = get_message(engine)
+    assert first.sent is None
+    assert first.next_attempt - datetime.now() > timedelta(minutes=9)
+
+    # the message waits for its next attempt
+    assert bot.deliver(config, engine, args) == []
+
+    with Session(engine) as session:
+        session.get(OutboxMessage, first.id).next_attempt = datetime.now()
+        session.commit()
+    bot.deliver(config, engine, args)
+    second = get_message(engine)
+    assert second.attempts == 2
+    assert second.next_attempt - datetime.now() > timedelta(minutes=19)
+
+
+def test_messages_are_never_dropped_after_the_last_attempt(
+    bot, config, engine, mail_server, args, monkeypatch, caplog
+):
+    with Session(engine) as session:
+        session.add(
+            OutboxMessage(
+                receiver="a@example.com",
+                subject="s",
+                content="c",
+                attempts=5,
+                next_attempt=datetime.now() - timedelta(minutes=1),
+            )
+        )
+        session.commit()
+
+    with caplog.at_level(logging.ERROR):
+        bot.deliver(config, engine, args)
+    assert "failed 6 times, retrying later" in caplog.text
+    assert get_message(engine).next_attempt - datetime.now() <= bot.MAX_DELIVERY_BACKOFF
+    with Session(engine) as session:
+        assert bot.count_overdue_messages(session, args.max_delivery_attempts) == 1
+
+        session.get(OutboxMessage, 1).next_attempt = datetime.now()
+        session.commit()
+    monkeypatch.setattr(mail_server, "accepts", True)
+    bot.deliver(config, engine, args)
+
+    assert get_message(engine).sent is not None
+    with Session(engine) as session:
+        assert bot.count_overdue_messages(session, args.max_delivery_attempts) == 0
@@ -0,0 +1,178 @@
+import os
+from datetime import datetime
+
+import pytest
+
+from sgs import APARTMENT_URL, SGSApartment, _paginate, parse_cards
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "market_page.html")
+
+
+@pytest.fixture
+def page_source():
+    with open(FIXTURE, encoding="utf-8") as f:
+        return f.read()
+
+
+def test_parse_cards_reads_the_fields_like_inner_text(page_source):
+    assert parse_cards(page_source) == [
+        {
+            "id": "1234-5678",
+            "address": "Olofshöjdsvägen 12",
+            "location": "Olofshöjd",
+            "size": "1 rok\nStorlek",
+            "area": "24.5\nm2",
+            "rent": "4523\nkr/mån",
+            "free-from": "2026-11-01\nTillträde",
+        },
+        {
+            "id": "2345-6789",
+            "address": "Rotpartnergatan 3 & 5",
+            "location": "Rotpartner",
+            "size": "Korridorrum\nStorlek",
+            "area": "18\nm2",
+            "rent": "3810\nkr/mån\ninkl. el",
+            "free-from": "2026-12-15\nTillträde",
+        },
+    ]
+
+
+def test_from_card_parses_the_saved_market_page(page_source):
+    apartments = [SGSApartment.from_card(card) for card in parse_cards(page_source)]
+
+    assert apartments == [
+        SGSApartment(
+            id="1234-5678",
+            address="Olofshöjdsvägen 12",
+            location="Olofshöjd",
+            size="1 rok",
+            area=24.5,
+            rent=4523,
+            free_from=datetime(2026, 11, 1),
+            url=APARTMENT_URL.format("1234-5678"),
+        ),
+        SGSApartment(
+            id="2345-6789",
+            address="Rotpartnergatan 3 & 5",
+            location="Rotpartner",
+            size="Korridorrum",
+            area=18.0,
+            rent=3810,
+            free_from=datetime(2026, 12, 15),
+            url=APARTMENT_URL.format("2345-6789"),
+        ),
+    ]
+
+
+def test_parse_cards_without_listings():
+    page_source = (
+        "<html><head><title>Mina Sidor</title></head><body>"
+        "<taiga-market-objects-list></taiga-market-objects-list></body></html>"
+    )
+
+    assert parse_cards(page_source) == []
+
+
+def test_from_card_reads_the_first_line_of_multi_line_fields():
+    apartment = SGSApartment.from_card(
+        {
+            "id": "1",
+            "address": "Gibraltargatan 82",
+            "location": "Gibraltar",
+            "size": "2 rok\nStorlek",
+            "area": "41.5\nm²",
+            "rent": "6120\nkr/mån\nInklusive el",
+            "free-from": "2027-01-01\nTillträde",
+        }
+    )
+
+    assert (apartment.size, apartment.area, apartment.rent, apartment.free_from) == (
+        "2 rok",
+        41.5,
+        6120,
+        datetime(2027, 1, 1),
+    )
+
+
+def test_from_card_rejects_malformed_numbers():
+    with pytest.raises(ValueError):
+        SGSApartment.from_card(
+            {
+                "id": "1",
+                "address": "Gibraltargatan 82",
+                "location": "Gibraltar",
+                "size": "2 rok",
+                "area": "41,5 m²",
+                "rent": "6120",
+                "free-from": "2027-01-01",
+            }
+        )
+
+
+def listing(number):
+    return SGSApartment(
+        id=f"{number:04d}-0000",
+        address=f"Gibraltargatan {number}",
+        location="Gibraltar",
+        size="1 rok",
+        area=25.0,
+        rent=4500,
+        free_from=datetime(2027, 1, 1),
+        url=APARTMENT_URL.format(f"{number:04d}-0000"),
+    )
+
+
+class FakeMarket:
+    def __init__(self, listings, cap=None, ignores_page=False) -> None:
+        self.listings = listings
+        self.cap = cap
+        self.ignores_page = ignores_page
+        self.requested_pages = []
+
+    def get_page(self, page, page_size):
+        self.requested_pages.append(page)
+        if self.cap is not None:
+            page_size = min(page_size, self.cap)
+        start = 0 if self.ignores_page else (page - 1) * page_size
+        return self.listings[start : start + page_size]
+
+
+def test_paginate_walks_every_page():
+    market = FakeMarket([listing(number) for number in range(250)])
+
+    apartments = list(_paginate(market.get_page, 100))
+
+    assert apartments == market.listings
+    assert market.requested_pages == [1, 2, 3]
+
+
+def test_paginate_walks_a_market_that_caps_the_page_size():
+    market = FakeMarket([listing(number) for number in range(250)], cap=100)
+
+    apartments = list(_paginate(market.get_page, 500))
+
+    assert apartments == market.listings
+    assert market.requested_pages == [1, 2, 3]
+
+
+def test_paginate_stops_when_the_page_parameter_is_ignored():
+    market = FakeMarket([listing(number) for number in range(250)], ignores_page=True)
+
+    apartments = list(_paginate(market.get_page, 100))
+
+    assert apartments == market.listings[:100]
+    assert market.requested_pages == [1, 2]
+
+
+def test_paginate_keeps_listings_that_shift_between_pages():
+    listings = [listing(number) for number in range(250)]
+    market = FakeMarket(list(listings))
+    pages = _paginate(market.get_page, 100)
+
+    apartments = [next(pages) for _ in range(100)]
+    # a new listing at the top pushes every following listing one place back
+    market.listings.insert(0, listing(1000))
+    apartments.extend(pages)
+
+    assert len({apartment.id for apartment in apartments}) == len(apartments)
+    assert all(apartment in apartments for apartment in listings)